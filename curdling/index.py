@@ -15,17 +15,55 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import absolute_import, print_function, unicode_literals
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
-from threading import RLock
+from threading import Lock, RLock
+from distlib.compat import OrderedDict
+from distlib.wheel import Wheel as DistlibWheel
 from pkg_resources import parse_version
+from .signal import SignalEmitter, Signal
 from .util import split_name, filehash, safe_name, parse_requirement
+from .wheel import Wheel
 
+import io
 import os
 import re
+import json
+import hashlib
 import shutil
+import tempfile
 
 FORMATS = ('whl', 'gz', 'bz', 'zip')
 
+# Directory (inside of the index's base path) that holds the files the index
+# writes about itself. Its name starts with a dot, so `Index.scan()` will
+# never mistake it for a package.
+META_DIR = '.curdling'
+
+# The manifest saves the result of the last scan, so we don't need to list
+# the whole directory and parse every single file name on every startup.
+# Bump the version when the structure of the file changes, old manifests
+# will be just ignored.
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# Changes to single files (new packages, digests calculated on demand) are
+# appended to the journal instead of rewriting the whole manifest. The next
+# scan merges the journal into the manifest.
+JOURNAL_NAME = 'journal'
+
+# Size of the blocks read or written when copying and hashing files
+BLOCK_SIZE = 2 ** 20
+
+# Folders used by the `ShardedIndex`. Package files are stored once under
+# `objects`, named after their digest. The `names` folder contains symlinks
+# with the package names pointing to their content.
+OBJECTS_DIR = 'objects'
+NAMES_DIR = 'names'
+
+# How many results of `Index.get()` are kept in memory
+QUERY_CACHE_SIZE = 4096
+
 PKG_NAMES = [
     r'([\w\-\_\.]+)-([\d\.]+\d)[\.\-]',
     r'(\w+)-(.+)\.\w+$',
@@ -55,61 +93,588 @@ class PackageNotFound(Exception):
         super(PackageNotFound, self).__init__(''.join(msg))
 
 
-class Index(object):
-
-    def __init__(self, base_path):
+class VersionList(object):
+    """Versions of a single package, sorted by their parsed value
+
+    It allows `Index.get()` to find the best version for a set of constraints
+    with a few bisections instead of parsing and comparing every single
+    version available in the index.
+    """
+
+    def __init__(self, versions=()):
+        self.keys = []
+        self.versions = []
+        for version in versions:
+            self.add(version)
+
+    def __len__(self):
+        return len(self.versions)
+
+    def copy(self):
+        other = VersionList()
+        other.keys = list(self.keys)
+        other.versions = list(self.versions)
+        return other
+
+    def add(self, version):
+        key = parse_version(version)
+        position = bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.versions.insert(position, version)
+
+    def remove(self, version):
+        position = self.versions.index(version)
+        del self.keys[position]
+        del self.versions[position]
+
+    def best(self, constraints):
+        low, high = 0, len(self.keys)
+        excluded = []
+        for operator, version in constraints or []:
+            key = parse_version(version)
+            if operator == '==':
+                low = max(low, bisect_left(self.keys, key))
+                high = min(high, bisect_right(self.keys, key))
+            elif operator == '>=':
+                low = max(low, bisect_left(self.keys, key))
+            elif operator == '>':
+                low = max(low, bisect_right(self.keys, key))
+            elif operator == '<=':
+                high = min(high, bisect_right(self.keys, key))
+            elif operator == '<':
+                high = min(high, bisect_left(self.keys, key))
+            elif operator == '!=':
+                excluded.append(key)
+            else:
+                raise ValueError(
+                    'Unknown version operator: {0}'.format(operator))
+
+        # Walking from the newest version down, the first one that was not
+        # explicitly excluded is the one we want
+        for position in range(high - 1, low - 1, -1):
+            if self.keys[position] not in excluded:
+                return self.versions[position]
+        return None
+
+
+class QueryCache(object):
+    """Bounded LRU cache for the results of `Index.get()`
+
+    Entries are grouped by package name, so the index can forget everything
+    it knows about a package when a new file for it shows up. Each package
+    also has a generation number, bumped when it's invalidated. Results
+    calculated before that are not cached, since they might be outdated.
+    """
+
+    def __init__(self, size=QUERY_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.keys = defaultdict(set)
+        self.generations = defaultdict(int)
+        self.lock = Lock()
+
+    def generation(self, name):
+        return self.generations.get(name, 0)
+
+    def get(self, key):
+        with self.lock:
+            try:
+                name, value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries[key] = name, value
+            self.hits += 1
+            return value
+
+    def set(self, name, key, value, generation=None):
+        if not self.size:
+            return
+        with self.lock:
+            if generation is not None and \
+                    generation != self.generations.get(name, 0):
+                return
+            self.entries.pop(key, None)
+            self.entries[key] = name, value
+            self.keys[name].add(key)
+            while len(self.entries) > self.size:
+                old_key, (old_name, _) = self.entries.popitem(last=False)
+                self.keys[old_name].discard(old_key)
+
+    def invalidate(self, name):
+        with self.lock:
+            self.generations[name] += 1
+            for key in self.keys.pop(name, ()):
+                self.entries.pop(key, None)
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class Index(SignalEmitter):
+    """Keeps track of the packages saved in a directory
+
+    Lookups happen from many threads while other threads add packages, so
+    the storage is never changed in place. Writers hold `self.lock`, build a
+    new dictionary of versions for the package they're changing, and then
+    replace the old one. Readers never block and always see a consistent
+    snapshot of a package.
+
+    When `supported_tags` is informed (see `wheel.supported_tags()`), `get()`
+    only returns wheels matching one of the tags, preferring the ones that
+    appear first in the list. Otherwise any wheel is good.
+
+    The `updated` signal is emitted with the name of a package every time
+    one of its files is added or removed.
+    """
+
+    def __init__(self, base_path, cache_size=QUERY_CACHE_SIZE,
+                 supported_tags=None):
+        super(Index, self).__init__()
         self.base_path = base_path
-        self.storage = defaultdict(lambda: defaultdict(list))
+        self.supported_tags = supported_tags
+        self.tag_ranks = dict(
+            (tag, rank) for rank, tag in enumerate(supported_tags or []))
+        self.wheel_ranks = {}
+        self.storage = {}
+        self.files = {}
+        self.sorted_versions = {}
+        self.cache = QueryCache(cache_size)
+        self.mtimes = {}
         self.lock = RLock()
 
+        # Declaring signals
+        self.updated = Signal()
+
     def scan(self):
         if not os.path.isdir(self.base_path):
             return
 
+        # The manifest is trusted as long as nobody touched the directories
+        # after it was written. Otherwise we list the directories again but
+        # reuse everything we already know about the files that didn't change
+        manifest = self.load_manifest()
+        journal = self.load_journal()
+        if not manifest:
+            # Creating the folder of the manifest changes the mtime of the
+            # base path, so it has to happen before we read it
+            try:
+                self.ensure_path(self.manifest_path())
+            except OSError:
+                pass
+        mtimes = self.get_mtimes()
+        files = dict(manifest.get('files', {}), **journal)
+        if manifest.get('mtimes') != mtimes:
+            files = self.reconcile(files)
+        if manifest.get('mtimes') != mtimes or journal:
+            self.save_manifest({'mtimes': mtimes, 'files': files})
+
+        for file_name, record in files.items():
+            self.index(self.path(file_name), record)
+        self.mtimes = mtimes
+
+    def refresh(self):
+        """Pick up files added, changed or removed by other processes
+
+        It's cheap to call it often, the directories are only listed again
+        when their mtime changes. Returns `True` if anything was checked.
+        """
+        if not os.path.isdir(self.base_path):
+            return False
+        mtimes = self.get_mtimes()
+        dirty = set(path for path, mtime in mtimes.items()
+                    if self.mtimes.get(path) != mtime)
+        dirty.update(set(self.mtimes) - set(mtimes))
+        self.mtimes = mtimes
+        if not dirty:
+            return False
+
+        # Only the directories that changed are listed again
+        directory = lambda f: os.path.relpath(
+            os.path.dirname(self.path(f)), self.base_path)
+        found = set()
+        for path in dirty:
+            try:
+                names = os.listdir(os.path.join(self.base_path, path))
+            except OSError:
+                continue
+            found.update(f for f in names
+                         if not f.startswith('.') and directory(f) == path)
+        known = set(f for f in list(self.files) if directory(f) in dirty)
+
+        for file_name in known - found:
+            self.unindex(file_name)
+        for file_name in found - known:
+            self.index(self.path(file_name))
+
+        # Files can also be replaced by others with the same name, by an
+        # upload to another server sharing the directory or by an rsync
+        for file_name in known & found:
+            try:
+                stat = os.stat(self.path(file_name))
+            except OSError:
+                continue
+            if not self.fresh_record(file_name, stat):
+                self.index(self.path(file_name),
+                           self.describe(file_name, stat))
+        return True
+
+    def get_mtimes(self):
+        return dict(
+            (os.path.relpath(path, self.base_path), os.stat(path).st_mtime)
+            for path in self.directories())
+
+    def directories(self):
+        """List the directories that contain package files"""
+        return [self.base_path]
+
+    def list_files(self):
         for file_name in os.listdir(self.base_path):
-            destination = os.path.join(self.base_path, file_name)
-            self.index(destination)
+            if not file_name.startswith('.'):
+                yield file_name
+
+    def path(self, fname):
+        """Full path for the package file `fname`"""
+        return os.path.join(self.base_path, fname)
+
+    def reconcile(self, known):
+        files = {}
+        for file_name in self.list_files():
+            stat = os.stat(self.path(file_name))
+            record = known.get(file_name)
+            if not record or (record.get('size'), record.get('mtime')) != \
+                    (stat.st_size, stat.st_mtime):
+                record = self.describe(file_name, stat)
+            files[file_name] = record
+        return files
+
+    def manifest_path(self):
+        return os.path.join(self.base_path, META_DIR, MANIFEST_NAME)
+
+    def load_manifest(self):
+        """Read the manifest saved by the last scan
+
+        An empty manifest is returned when the file doesn't exist, can't be
+        parsed or was written by an incompatible version of curdling. It will
+        just cause a full scan of the directory.
+        """
+        try:
+            with io.open(self.manifest_path(), 'rb') as fobj:
+                manifest = json.loads(fobj.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(manifest, dict) or \
+                not isinstance(manifest.get('files'), dict) or \
+                manifest.get('version') != MANIFEST_VERSION:
+            return {}
+        return manifest
+
+    def save_manifest(self, manifest):
+        # Writing to a temporary file and renaming it afterwards, so other
+        # processes reading the manifest never see it half written. The
+        # manifest is just a cache, failing to save it is not a big deal.
+        manifest = dict(manifest, version=MANIFEST_VERSION)
+        try:
+            destination = self.ensure_path(self.manifest_path())
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(destination))
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as fobj:
+                fobj.write(json.dumps(manifest).encode('utf-8'))
+            os.rename(temp, destination)
+        except (IOError, OSError):
+            os.unlink(temp)
+            return
+
+        # Everything in the journal is in the manifest now
+        try:
+            os.unlink(self.journal_path())
+        except OSError:
+            pass
+
+    def journal_path(self):
+        return os.path.join(self.base_path, META_DIR, JOURNAL_NAME)
+
+    def load_journal(self):
+        files = {}
+        try:
+            with io.open(self.journal_path(), 'rb') as fobj:
+                lines = fobj.read().decode('utf-8').splitlines()
+        except (IOError, OSError):
+            return files
+
+        # A process might have died while writing the last line, so we just
+        # ignore lines we can't read
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                files[entry['file']] = entry['record']
+            except (ValueError, KeyError, TypeError):
+                continue
+        return files
+
+    def save_journal(self, file_name, record):
+        line = json.dumps({'file': file_name, 'record': record}) + '\n'
+        try:
+            with io.open(self.ensure_path(self.journal_path()), 'ab') as fobj:
+                fobj.write(line.encode('utf-8'))
+        except (IOError, OSError):
+            pass
+
+    def describe(self, file_name, stat=None):
+        name, version = pkg_name(file_name)
+        return {
+            'name': safe_name(name),
+            'version': version,
+            'format': split_name(file_name)[1],
+            'size': stat and stat.st_size,
+            'mtime': stat and stat.st_mtime,
+            'sha256': None,
+        }
 
     def ensure_path(self, destination):
         path = os.path.dirname(destination)
-        with self.lock:
-            if not os.path.isdir(path):
+        if not os.path.isdir(path):
+            try:
                 os.makedirs(path)
+            except OSError:
+                # Another thread or process might have won the race
+                if not os.path.isdir(path):
+                    raise
         return destination
 
-    def index(self, path):
+    def index(self, path, record=None):
         pkg = os.path.basename(path)
-        name, version = pkg_name(pkg)
-        self.storage[safe_name(name)][version].append(pkg)
+        if record is None:
+            try:
+                record = self.describe(pkg, os.stat(path))
+            except OSError:
+                record = self.describe(pkg)
+        name, version = record['name'], record['version']
+        if self.supported_tags is not None and record['format'] == 'whl':
+            self.wheel_rank(pkg)
+        with self.lock:
+            previous = self.files.get(pkg)
+            self.files[pkg] = record
+            current = self.storage.get(name, {})
+            files = current.get(version, [])
+            if pkg in files:
+                # Same name, but whatever was said about the old content (like
+                # its digest) is wrong now
+                if not self.content_changed(previous, record):
+                    return
+            else:
+                versions = dict(current)
+                versions[version] = files + [pkg]
+                # The sorted list only changes when a new version shows up,
+                # otherwise it just follows the new dictionary
+                sorted_versions = self.get_sorted_versions(name, current)
+                if version not in current:
+                    sorted_versions = sorted_versions.copy()
+                    sorted_versions.add(version)
+                self.sorted_versions[name] = versions, sorted_versions
+                self.storage[name] = versions
+            self.cache.invalidate(name)
+        self.emit('updated', self.name, package=name)
+
+    def content_changed(self, previous, record):
+        if previous is None:
+            return False
+        if (previous.get('size'), previous.get('mtime')) != \
+                (record.get('size'), record.get('mtime')):
+            return True
+        # Digests are calculated lazily, a missing one doesn't mean much
+        return bool(previous.get('sha256') and record.get('sha256')) and \
+            previous['sha256'] != record['sha256']
+
+    def unindex(self, file_name):
+        with self.lock:
+            record = self.files.pop(file_name, None)
+            if record is None:
+                return
+            name, version = record['name'], record['version']
+            current = self.storage.get(name, {})
+            versions = dict(current)
+            files = [f for f in versions.get(version, []) if f != file_name]
+            sorted_versions = self.get_sorted_versions(name, current)
+            if files:
+                versions[version] = files
+            elif version in versions:
+                versions.pop(version)
+                sorted_versions = sorted_versions.copy()
+                sorted_versions.remove(version)
+            if versions:
+                self.storage[name] = versions
+                self.sorted_versions[name] = versions, sorted_versions
+            else:
+                self.storage.pop(name, None)
+                self.sorted_versions.pop(name, None)
+            self.cache.invalidate(name)
+        self.emit('updated', self.name, package=name)
 
     def from_file(self, path):
-        # Moving the file around
-        file_name = '.'.join(split_name(os.path.basename(path))[:2])
-        destination = self.ensure_path(os.path.join(self.base_path, file_name))
-        shutil.copy(path, destination)
-        self.index(destination)
-        return destination
+        with io.open(path, 'rb') as fobj:
+            return self.from_stream(path, fobj)
 
     def from_data(self, path, data):
+        return self.from_stream(path, [data])
+
+    def from_stream(self, path, stream):
+        """Save a package without holding all its data in memory
+
+        The `stream` parameter can be either a file-like object opened in
+        binary mode or any iterable of byte strings. Data is written to a
+        temporary file that is renamed when complete, so nobody ever sees
+        half written packages.
+        """
         # Build the name of the package based on its spec and extension
         file_name = '.'.join(split_name(os.path.basename(path))[:2])
-        destination = self.ensure_path(os.path.join(self.base_path, file_name))
-        with open(destination, 'wb') as fobj:
-            fobj.write(data)
-        self.index(destination)
+        chunks = stream
+        if hasattr(stream, 'read'):
+            chunks = iter(lambda: stream.read(BLOCK_SIZE), b'')
+        destination, digest = self.write(file_name, chunks)
+
+        # Uploading a file we already have changes nothing
+        stat = os.stat(destination)
+        known = self.fresh_record(file_name, stat)
+        if known.get('sha256') == digest and self.is_indexed(file_name):
+            return destination
+        record = self.describe(file_name, stat)
+        record['sha256'] = digest
+        self.index(destination, record)
+        self.save_journal(file_name, record)
         return destination
 
+    def write(self, file_name, chunks):
+        destination = self.ensure_path(self.path(file_name))
+        temp, digest = self.write_temp(os.path.dirname(destination), chunks)
+
+        # The file we have is kept untouched if the new one has the same
+        # content, so its mtime (and everything cached about it) stays valid
+        if os.path.exists(destination) and self.digest(file_name) == digest:
+            os.unlink(temp)
+        else:
+            os.rename(temp, destination)
+        return destination, digest
+
+    def write_temp(self, directory, chunks):
+        # The digest is calculated while we write the chunks down, so we
+        # never have to read the file again. Temporary files start with a
+        # dot, so `scan()` will never index them.
+        fd, temp = tempfile.mkstemp(prefix='.', dir=directory)
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as fobj:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    fobj.write(chunk)
+            os.chmod(temp, 0o644)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        return temp, digest.hexdigest()
+
     def delete(self):
         shutil.rmtree(self.base_path)
 
     def list_packages(self):
-        return self.storage.keys()
+        return list(self.storage)
+
+    def has_package(self, name):
+        """Cheap check that doesn't parse anything or raise exceptions
+
+        The `name` must be already normalized, see `util.safe_name()`.
+        """
+        return name in self.storage
 
     def get_urlhash(self, url, fmt):
         """Returns the hash of the file of an internal url
+
+        Wheels also carry their requirements, so clients can look for them
+        before the download is done.
+        """
+        info = {'url': fmt(url), 'sha256': self.digest(url)}
+        dependencies = self.dependencies(url)
+        if dependencies is not None:
+            info['dependencies'] = dependencies
+        return info
+
+    def fresh_record(self, file_name, stat):
+        """The record of a file, if it didn't change since it was saved"""
+        record = self.files.get(file_name) or {}
+        if (record.get('size'), record.get('mtime')) != \
+                (stat.st_size, stat.st_mtime):
+            return {}
+        return record
+
+    def is_indexed(self, file_name):
+        record = self.files.get(file_name)
+        return record is not None and file_name in self.storage.get(
+            record['name'], {}).get(record['version'], [])
+
+    def update_record(self, file_name, stat, **fields):
+        # Everything we know about the file is kept, unless it changed. Files
+        # that are not in the index yet are left for `index()` to register,
+        # otherwise they'd look known while nothing can find them.
+        record = self.fresh_record(file_name, stat) or \
+            self.describe(file_name, stat)
+        record = dict(record, **fields)
+        if self.is_indexed(file_name):
+            self.files[file_name] = record
+            self.save_journal(file_name, record)
+        return record
+
+    def digest(self, fname):
+        """Returns the sha256 digest of a file in the index
+
+        Digests are saved along with the other information we have about the
+        file, so they're only calculated again if the file changes.
+        """
+        file_name = os.path.basename(fname)
+        stat = os.stat(self.path(file_name))
+        sha256 = self.fresh_record(file_name, stat).get('sha256')
+        if sha256:
+            return sha256
+
+        with self.open(file_name, 'rb') as f:
+            sha256 = filehash(f, 'sha256', BLOCK_SIZE)
+        self.update_record(file_name, stat, sha256=sha256)
+        return sha256
+
+    def dependencies(self, fname):
+        """Returns the requirements declared in the metadata of a wheel
+
+        The result looks like `{"install": [...], "extras": {...}}` and is
+        saved just like the digests. Other formats have to be built before
+        we know their requirements, so `None` is returned for them.
         """
-        with self.open(os.path.basename(url)) as f:
-            return {'url': fmt(url), 'sha256': filehash(f, 'sha256')}
+        file_name = os.path.basename(fname)
+        if split_name(file_name)[1] != 'whl':
+            return None
+        stat = os.stat(self.path(file_name))
+        record = self.fresh_record(file_name, stat)
+        if 'dependencies' in record:
+            return record['dependencies']
+
+        try:
+            dependencies = DistlibWheel(
+                os.path.abspath(self.path(file_name))).metadata.dependencies
+        except Exception:
+            # Clients will have to download the wheel to find out
+            return None
+        dependencies = {
+            'install': list(dependencies.get('install', [])),
+            'extras': dict(dependencies.get('extras', {})),
+        }
+        self.update_record(file_name, stat, dependencies=dependencies)
+        return dependencies
 
     def package_releases(self, package, url_fmt=lambda u: u):
         """List all versions of a package
@@ -124,8 +689,17 @@ class Index(object):
         } for version, files in self.storage.get(package, {}).items()]
 
     def open(self, fname, mode='r'):
-        return open(os.path.abspath(os.path.join(
-            self.base_path, os.path.basename(fname))), mode)
+        return open(os.path.abspath(self.path(os.path.basename(fname))), mode)
+
+    def get_sorted_versions(self, name, versions):
+        # The sorted list is only valid for the exact dictionary of versions
+        # it was built from. The storage might also be filled without going
+        # through `index()`, so we rebuild it when they don't match
+        built_from, sorted_versions = self.sorted_versions.get(name, (None, None))
+        if built_from is not versions:
+            sorted_versions = VersionList(versions)
+            self.sorted_versions[name] = versions, sorted_versions
+        return sorted_versions
 
     def get(self, query):
         # Read both: "pkg==0.0.0" and "pkg==0.0.0,fmt"
@@ -133,43 +707,135 @@ class Index(object):
         spec, format_ = (sym in query and (query.split(sym)) or (query, ''))
         requirement = parse_requirement(spec)
 
+        # Different queries might mean the same thing, like "Pkg>=0.1" and
+        # "pkg (>= 0.1)", so we use the normalized form for caching
+        key = '{0};{1}'.format(requirement.requirement, format_)
+        found = self.cache.get(key)
+        if found is None:
+            generation = self.cache.generation(requirement.name)
+            try:
+                found = self.find(requirement, spec, format_)
+            except PackageNotFound:
+                found = PackageNotFound
+            self.cache.set(requirement.name, key, found, generation)
+        if found is PackageNotFound:
+            raise PackageNotFound(spec, format_)
+        return found
+
+    def wheel_rank(self, file_name):
+        """Position of the best tag of a wheel in the supported tags list
+
+        Returns `None` for wheels that can't be installed. Ranks are computed
+        only once per file.
+        """
+        try:
+            return self.wheel_ranks[file_name]
+        except KeyError:
+            pass
+        try:
+            tags = Wheel.from_name(os.path.basename(file_name)).all_tags()
+        except (IndexError, AttributeError):
+            tags = []
+        ranks = [self.tag_ranks[tag] for tag in tags if tag in self.tag_ranks]
+        rank = self.wheel_ranks[file_name] = min(ranks) if ranks else None
+        return rank
+
+    def compatible_wheels(self, wheels):
+        if self.supported_tags is None:
+            return wheels
+        ranked = [(self.wheel_rank(w), w) for w in wheels]
+        return [w for rank, w in sorted(
+            (r for r in ranked if r[0] is not None), key=lambda r: r[0])]
+
+    def find(self, requirement, spec, format_):
         # [First step] Looking up the package name parsed from the spec
         versions = self.storage.get(requirement.name)
         if not versions:
             raise PackageNotFound(spec, format_)
 
-        # [Second step] Filter out versions incompatible with our spec
-        parsed_versions = {}
-        [parsed_versions.update({parse_version(v): v}) for v in versions.keys()]
-
-        filter_cmp = lambda x: all({
-            '<':  lambda v: x <  parse_version(v),
-            '<=': lambda v: x <= parse_version(v),
-            '!=': lambda v: x != parse_version(v),
-            '==': lambda v: x == parse_version(v),
-            '>=': lambda v: x >= parse_version(v),
-            '>':  lambda v: x >  parse_version(v),
-        }[op](v) for op, v in requirement.constraints or [])
-
-        compat_versions = [c for c in parsed_versions.keys() if filter_cmp(c)]
-        if not compat_versions:
+        # [Second step] Find the newest version compatible with our spec
+        sorted_versions = self.get_sorted_versions(requirement.name, versions)
+        best_version = sorted_versions.best(requirement.constraints)
+        if best_version is None:
             raise PackageNotFound(spec, format_)
 
-        # [Third step] Find best version to match the given format
-        files = []
-
-        # We don't have version or format, so we'll get the latest. Also,
-        # we'll bring the wheels preferably, if they're available
-        latest_version = versions[parsed_versions[max(compat_versions)]]
-        if format_:
-            files = [n for n in latest_version if match_format(format_, n)]
-        else:
-            wheels = [n for n in latest_version if match_format('whl', n)]
-            files = wheels or latest_version
+        # [Third step] Find best version to match the given format. We'll
+        # bring the wheels preferably, if there are compatible ones available
+        candidates = [n for n in versions[best_version]
+                      if not format_ or match_format(format_, n)]
+        files = self.compatible_wheels(
+            [n for n in candidates if match_format('whl', n)])
+        files.extend(n for n in candidates if not match_format('whl', n))
 
         # Unlucky, we really don't have those files
         if not files:
             raise PackageNotFound(spec, format_)
 
         # Yay, let's return the full path to the user
-        return os.path.join(self.base_path, files[0])
+        return self.path(files[0])
+
+
+class ShardedIndex(Index):
+    """Index that spreads its files over hashed subdirectories
+
+    Huge flat directories are slow on most file systems. This index saves
+    the content of each package under `objects/<xx>/<yy>/<sha256>`, so
+    identical uploads under different names are stored only once, and
+    exposes the package names as symlinks under `names/<zz>/<name>`.
+    """
+
+    def directories(self):
+        names = os.path.join(self.base_path, NAMES_DIR)
+        if not os.path.isdir(names):
+            return []
+        return [names] + [os.path.join(names, shard)
+                          for shard in os.listdir(names)
+                          if not shard.startswith('.')]
+
+    def list_files(self):
+        for directory in self.directories()[1:]:
+            for file_name in os.listdir(directory):
+                if not file_name.startswith('.'):
+                    yield file_name
+
+    def path(self, fname):
+        file_name = os.path.basename(fname)
+        shard = hashlib.sha1(file_name.encode('utf-8')).hexdigest()[:2]
+        return os.path.join(self.base_path, NAMES_DIR, shard, file_name)
+
+    def object_path(self, digest):
+        return os.path.join(
+            self.base_path, OBJECTS_DIR, digest[:2], digest[2:4], digest)
+
+    def describe(self, file_name, stat=None):
+        record = super(ShardedIndex, self).describe(file_name, stat)
+        if stat is not None:
+            # The symlink tells us the digest of the file for free
+            record['sha256'] = os.path.basename(
+                os.readlink(self.path(file_name)))
+        return record
+
+    def write(self, file_name, chunks):
+        objects = os.path.join(self.base_path, OBJECTS_DIR)
+        temp, digest = self.write_temp(os.path.dirname(
+            self.ensure_path(os.path.join(objects, file_name))), chunks)
+
+        # We don't need to save the same content twice
+        content = self.object_path(digest)
+        if os.path.exists(content):
+            os.unlink(temp)
+        else:
+            os.rename(temp, self.ensure_path(content))
+
+        # Replacing the symlink atomically, in case we already have a file
+        # with this name pointing to another content
+        destination = self.ensure_path(self.path(file_name))
+        if os.path.islink(destination) and \
+                os.path.basename(os.readlink(destination)) == digest:
+            return destination, digest
+        link = os.path.join(os.path.dirname(destination), '.' + file_name)
+        if os.path.lexists(link):
+            os.unlink(link)
+        os.symlink(os.path.relpath(content, os.path.dirname(destination)), link)
+        os.rename(link, destination)
+        return destination, digest
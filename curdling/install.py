@@ -109,6 +109,7 @@ class Install(Service):
         self.downloader.connect('finished', only(self.curdler.queue, 'tarball'))
         self.downloader.connect('finished', only(self.dependencer.queue, 'wheel'))
         self.curdler.connect('finished', self.dependencer.queue)
+        self.finder.connect('dependency_found', self.queue)
         self.dependencer.connect('dependency_found', self.queue)
 
         # Save the wheels that reached the end of the flow
@@ -165,7 +166,8 @@ class Install(Service):
 
     def handle(self, requester, **data):
         requirement = safe_name(data['requirement'])
-        if not is_url(requirement) and parse_requirement(requirement).name in PACKAGE_BLACKLIST:
+        name = not is_url(requirement) and parse_requirement(requirement).name
+        if name in PACKAGE_BLACKLIST:
             return
 
         # Filter duplicated requirements
@@ -178,11 +180,15 @@ class Install(Service):
         self.mapping.requirements.add(requirement)
         self.mapping.dependencies[requirement].append(data.get('dependency_of'))
 
+        # Most requirements are not in the local cache, so we don't bother
+        # asking it for wheels and tarballs of packages it doesn't know
+        cached = name and self.index.has_package(name)
+
         # Defining which place we're moving our requirements
         service = self.finder
-        if self.set_wheel(data):
+        if cached and self.set_wheel(data):
             service = self.dependencer
-        elif self.set_tarball(data):
+        elif cached and self.set_tarball(data):
             service = self.curdler
         elif self.set_url(data):
             service = self.downloader
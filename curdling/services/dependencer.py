@@ -5,6 +5,19 @@ from .base import Service
 from distlib.wheel import Wheel
 
 
+def get_dependencies(dependencies, requirement):
+    """Requirements of `requirement`, given the `dependencies` of its wheel
+
+    Honors the `extras` section of the requirement.
+    """
+    extra_sections = set(util.parse_requirement(requirement).extras or ())
+    found = list(dependencies.get('install', []))
+    for section, items in dependencies.get('extras', {}).items():
+        if section in extra_sections:
+            found.extend(items)
+    return found
+
+
 class Dependencer(Service):
 
     def __init__(self, *args, **kwargs):
@@ -14,16 +27,9 @@ class Dependencer(Service):
     def handle(self, requester, data):
         requirement = data['requirement']
         dependencies = Wheel(data['wheel']).metadata.dependencies
-        extra_sections = set(util.parse_requirement(requirement).extras or ())
-
-        # Honor the `extras` section of the requirement we just received
-        found = dependencies.get('install', [])
-        for section, items in dependencies.get('extras', {}).items():
-            if section in extra_sections:
-                found.extend(items)
 
         # Telling the world about the dependencies we found
-        for dependency in found:
+        for dependency in get_dependencies(dependencies, requirement):
             self.emit('dependency_found', self.name,
                       requirement=util.safe_name(dependency),
                       dependency_of=requirement)
@@ -1,7 +1,9 @@
 from __future__ import absolute_import, print_function, unicode_literals
 from ..exceptions import RequirementNotFound, UnknownURL, TooManyRedirects, ReportableError
 from .. import util
+from ..signal import Signal
 from .base import Service
+from .dependencer import get_dependencies
 from distlib import database, metadata, compat, locators
 
 import os
@@ -20,6 +22,10 @@ POOL_MAX_SIZE = 10
 # Number of max redirect follows. See `http_retrieve()` for details.
 REDIRECT_LIMIT = 20
 
+# Size of the blocks read from the network and handed to the index while
+# downloading packages.
+DOWNLOAD_CHUNK_SIZE = 2 ** 16
+
 
 def get_locator(conf):
     curds = [CurdlingLocator(u) for u in conf.get('curdling_urls', [])]
@@ -215,13 +221,53 @@ class CurdlingLocator(locators.Locator, ComparableLocator):
         self.url = url
         self.opener = get_opener()
         self.requirements_not_found = []
+        self.prefetched = {}
 
     def get_distribution_names(self):
         return json.loads(
             http_retrieve(self.opener,
                 compat.urljoin(self.url, 'api'))[0].data)
 
+    def prefetch(self, names):
+        """Retrieve the releases of many packages in a single request
+
+        Servers that don't have the batch endpoint are just ignored, their
+        packages will be retrieved one by one by `_get_project()`.
+        """
+        names = [name for name in names if name not in self.prefetched]
+        if not names:
+            return
+        headers = util.get_auth_info_from_url(self.url)
+        headers['Content-Type'] = 'application/json'
+        try:
+            response = self.opener.request(
+                'POST', compat.urljoin(self.url, 'api/'),
+                body=json.dumps({'packages': names}), headers=headers)
+        except urllib3.exceptions.HTTPError:
+            return
+        if response.status != 200:
+            return
+
+        # Whatever answered is not a curdling server after all
+        try:
+            projects = json.loads(response.data.decode('utf-8'))
+        except ValueError:
+            return
+        if not isinstance(projects, dict):
+            return
+        for name in names:
+            releases = projects.get(name)
+            self.prefetched[name] = releases and dict(
+                (v['version'], self._get_distribution(v)) for v in releases)
+
     def _get_project(self, name):
+        # Packages found by `prefetch()` don't need another request
+        if name in self.prefetched:
+            versions = self.prefetched[name]
+            if not versions:
+                self.requirements_not_found.append(name)
+            return versions
+
         # Retrieve the info
         url = compat.urljoin(self.url, 'api/' + name)
         try:
@@ -239,6 +285,11 @@ class CurdlingLocator(locators.Locator, ComparableLocator):
         # Source url for the package
         source_url = version['urls'][0]  # TODO: prefer whl files
 
+        # Servers that read the metadata of their wheels tell us about the
+        # requirements of the package
+        dependencies = [u['dependencies'] for u in version['urls']
+                        if u.get('dependencies') is not None]
+
         # Build the metadata
         mdata = metadata.Metadata(scheme=self.scheme)
         mdata.name = version['name']
@@ -248,6 +299,8 @@ class CurdlingLocator(locators.Locator, ComparableLocator):
         # Building the dist and associating the download url
         distribution = database.Distribution(mdata)
         distribution.locator = self
+        distribution.curdling_dependencies = \
+            dependencies and dependencies[0] or None
         return distribution
 
 
@@ -257,6 +310,7 @@ class Finder(Service):
         super(Finder, self).__init__(*args, **kwargs)
         self.opener = get_opener()
         self.locator = get_locator(self.conf)
+        self.dependency_found = Signal()
 
     def handle(self, requester, data):
         requirement = data['requirement']
@@ -265,12 +319,33 @@ class Finder(Service):
         if not distribution:
             raise RequirementNotFound(
                 'Requirement `{0}\' not found'.format(requirement))
+
+        # When the server already told us the requirements of the package,
+        # they can be looked for while the package is still downloading. The
+        # `Dependencer` finds them again later, but they'll be ignored.
+        dependencies = getattr(distribution, 'curdling_dependencies', None)
+        for dependency in get_dependencies(dependencies or {}, requirement):
+            self.emit('dependency_found', self.name,
+                      requirement=util.safe_name(dependency),
+                      dependency_of=requirement)
         return {
             'requirement': data['requirement'],
             'url': distribution.metadata.download_url,
             'locator_url': distribution.locator.base_url,
         }
 
+    def prefetch(self, requirements):
+        """Ask the curdling servers about all the `requirements` at once
+
+        It saves one round trip per requirement when the servers are asked
+        about them later, by the `handle()` method.
+        """
+        names = [util.parse_requirement(util.safe_name(r)).name
+                 for r in requirements if not util.is_url(r)]
+        for locator in self.locator.locators:
+            if isinstance(locator, CurdlingLocator):
+                locator.prefetch(names)
+
     def get_servers_to_update(self):
         failures = {}
         for locator in self.locator.locators:
@@ -361,9 +436,9 @@ class Downloader(Service):
         # Now that we're sure that our request was successful
         header = response.headers.get('content-disposition', '')
         file_name = re.findall(r'filename=\"?([^;\"]+)', header)
-        return field_name, self.index.from_data(
+        return field_name, self.index.from_stream(
             file_name and file_name[0] or url,
-            response.read(cache_content=True, decode_content=False))
+            response.stream(DOWNLOAD_CHUNK_SIZE, decode_content=False))
 
     def _download_git(self, url):
         destination = tempfile.mkdtemp()
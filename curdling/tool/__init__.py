@@ -4,6 +4,7 @@ from ..index import Index
 from ..util import expand_requirements, safe_name, spaces, logger
 from ..version import __version__
 from ..services import curdler
+from ..wheel import supported_tags
 
 from ..install import Install
 from ..uninstall import Uninstall
@@ -168,7 +169,8 @@ def acceptable_file_type(filename):
 
 
 def get_install_command(args):
-    index = Index(os.path.expanduser('~/.curds'))
+    index = Index(os.path.expanduser('~/.curds'),
+                  supported_tags=supported_tags())
     index.scan()
 
     cmd = Install({
@@ -201,6 +203,7 @@ def get_install_command(args):
     # received packages before returning the command instance
     cmd.pipeline()
     cmd.start()
+    cmd.finder.prefetch(initial_requirements)
     for pkg in tarballs:
         metadata = pkginfo.SDist(pkg)
         cmd.queue(
@@ -31,6 +31,8 @@ INCLUDE_PATTERN = re.compile(r'-r\s*\b([^\b]+)')
 
 LINK_PATTERN = re.compile(r'^([^\:]+):\/\/.+')
 
+PROJECT_NAME_SEPARATORS = re.compile(r'[-_.]+')
+
 ROOT_LOGGER = logging.getLogger('curdling')
 
 
@@ -47,6 +49,11 @@ def safe_name(requirement):
         else safe_requirement(requirement)
 
 
+def canonical_name(name):
+    """Normalizes a project name following the rules of PEP 503"""
+    return PROJECT_NAME_SEPARATORS.sub('-', name).lower()
+
+
 def safe_requirement(requirement):
     safe = requirement.lower().replace('_', '-')
     parsed = util.parse_requirement(safe)
@@ -1,38 +1,374 @@
 from __future__ import unicode_literals, print_function, absolute_import
 
-from flask import Flask, render_template, send_file, request, Response
-from flask import Blueprint, current_app, url_for
+from flask import Flask, render_template, request, Response
+from flask import Blueprint, current_app, url_for, redirect, g
 from gevent.pywsgi import WSGIServer
+from gevent import socket, reinit
+from werkzeug.wsgi import wrap_file
+from werkzeug.http import is_resource_modified
+from calendar import timegm
+from datetime import datetime
 from functools import wraps
 
-from ..index import Index, PackageNotFound
-
+from ..index import Index, ShardedIndex, PackageNotFound, QueryCache
+from ..index import pkg_name
+from ..util import canonical_name, parse_requirement, safe_name, logger
+from collections import defaultdict
+from distlib.compat import OrderedDict
+from functools import partial
+from threading import Lock
+from .watcher import Watcher, POLL_INTERVAL
+from .metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .builds import Builds
+from .replication import Replicator, REPLICATION_INTERVAL
+from .proxy import Proxy
+
+import io
 import os
 import json
+import time
+import uuid
+import hmac
+import hashlib
+import zlib
 import crypt
+import errno
+import signal
+
+
+# Size of the blocks read from package files when the WSGI server can't send
+# them straight from the disk. Memory used per download never grows past it.
+DOWNLOAD_BUFFER_SIZE = 2 ** 16
+
+# How many rendered documents (like the JSON of the API) are kept in memory
+DOCUMENT_CACHE_SIZE = 4096
+
+# Documents that depend on the list of packages are grouped under this name,
+# which can't be confused with a package name, and are thrown away with the
+# documents of any package that changes
+ALL_PACKAGES = '*'
+
+# Encodings used to compress documents, in order of preference. Documents
+# smaller than `MIN_COMPRESS_SIZE` bytes are not worth the trouble.
+COMPRESSED_ENCODINGS = ['gzip', 'deflate']
+COMPRESSION_LEVEL = 9
+MIN_COMPRESS_SIZE = 1024
+
+# How many packages can be asked at once to the batch endpoint of the API
+MAX_BATCH_SIZE = 1000
+
+# Successful authentications are remembered for this many seconds, so we
+# don't run `crypt()` for every single request of a client
+AUTH_CACHE_TTL = 300
+AUTH_CACHE_SIZE = 1024
+
+# Connections waiting to be accepted by the workers of the pre-fork mode
+LISTEN_BACKLOG = 1024
+
+# Key of the map between PEP 503 project names and the names in the index,
+# saved along with the documents
+PROJECTS = ('projects',)
+
+# Key of the sorted list of package names shown in the landing page
+PACKAGES = ('packages',)
+
+# Packages listed in each page of the landing page
+PAGE_SIZE = 100
+
+# Pages of the landing page have a cache of their own, so clients trying
+# lots of filters can't push the documents of the API out of the other one.
+# Filters are also cut to a sane size.
+PAGE_CACHE_SIZE = 256
+MAX_FILTER_SIZE = 64
+
+
+def read_ranges(fobj, ranges, boundary=None, size=None):
+    """Yields the `ranges` of `fobj` in `DOWNLOAD_BUFFER_SIZE` blocks
+
+    When a `boundary` is given each range is wrapped in its own part of a
+    `multipart/byteranges` body. The file is closed in the end, even if the
+    client goes away in the middle of the transfer.
+    """
+    try:
+        for start, stop in ranges:
+            if boundary:
+                yield byterange_header(boundary, start, stop, size)
+            fobj.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = fobj.read(min(remaining, DOWNLOAD_BUFFER_SIZE))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        if boundary:
+            yield '\r\n--{0}--\r\n'.format(boundary).encode('ascii')
+    finally:
+        fobj.close()
+
+
+def byterange_header(boundary, start, stop, size):
+    return (
+        '\r\n--{0}\r\n'
+        'Content-Type: application/octet-stream\r\n'
+        'Content-Range: bytes {1}-{2}/{3}\r\n\r\n'
+    ).format(boundary, start, stop - 1, size).encode('ascii')
+
+
+def satisfiable_ranges(ranges, size):
+    """Converts the ranges of a `Range` header to `(start, stop)` offsets
+
+    Ranges that start after the end of the file are dropped, the others are
+    clipped to the file size.
+    """
+    result = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = min(size if stop is None else stop, size)
+        if start < stop:
+            result.append((start, stop))
+    return result
+
+
+def wants_range(etag, last_modified):
+    """Tells if the `Range` header of the request should be honored
+
+    An `If-Range` that doesn't match the current file means the client has
+    a piece of an older file, so it gets the whole new one instead.
+    """
+    if not request.range or request.range.units != 'bytes':
+        return False
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return last_modified is not None and \
+            int(last_modified) <= timegm(if_range.date.utctimetuple())
+    return True
+
+
+def send_package(path, etag=None, attachment=False):
+    """Stream a package file without loading it in memory
+
+    The file is handed to the `wsgi.file_wrapper` of the server, that might
+    use `sendfile()`, or read in `DOWNLOAD_BUFFER_SIZE` blocks otherwise.
+    When the `USE_X_SENDFILE` option is set, the front end server sends the
+    file and we don't even open it.
+
+    The `etag` (the digest of the file) is used to answer conditional
+    requests with `304` and `Range` requests with `206`, so clients don't
+    download again what they already have. Uploads can replace the content
+    of a name, so caches must always check with us before reusing a file.
+    """
+    try:
+        fobj = io.open(path, 'rb')
+    except IOError:
+        return 'package not found', 404
+
+    stat = os.fstat(fobj.fileno())
+    size = stat.st_size
+    response = Response(mimetype='application/octet-stream')
+    if etag:
+        response.set_etag(etag)
+    response.last_modified = datetime.utcfromtimestamp(int(stat.st_mtime))
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Cache-Control'] = 'no-cache'
+    if attachment:
+        response.headers['Content-Disposition'] = \
+            'attachment; filename={0}'.format(os.path.basename(path))
+
+    # The client already has this very same file
+    if not is_resource_modified(
+            request.environ, etag, last_modified=response.last_modified):
+        fobj.close()
+        response.status_code = 304
+        return response
+
+    if current_app.config['USE_X_SENDFILE']:
+        # The front end server handles ranges by itself
+        fobj.close()
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+        response.content_length = size
+        return response
+
+    if not wants_range(etag, stat.st_mtime):
+        response.response = wrap_file(
+            request.environ, fobj, DOWNLOAD_BUFFER_SIZE)
+        response.direct_passthrough = True
+        response.content_length = size
+        return response
+
+    ranges = satisfiable_ranges(request.range.ranges, size)
+    if not ranges:
+        fobj.close()
+        response.status_code = 416
+        response.headers['Content-Range'] = 'bytes */{0}'.format(size)
+        return response
+
+    response.status_code = 206
+    response.direct_passthrough = True
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        response.response = read_ranges(fobj, ranges)
+        response.headers['Content-Range'] = \
+            'bytes {0}-{1}/{2}'.format(start, stop - 1, size)
+        response.content_length = stop - start
+        return response
+
+    boundary = uuid.uuid4().hex
+    response.response = read_ranges(fobj, ranges, boundary, size)
+    response.headers['Content-Type'] = \
+        'multipart/byteranges; boundary={0}'.format(boundary)
+    response.content_length = sum(
+        len(byterange_header(boundary, start, stop, size)) + stop - start
+        for start, stop in ranges) + len(boundary) + 8
+    return response
+
+
+def get_document(package, render, endpoint=None, params=None,
+                 documents=None):
+    """Returns the `(body, etag, variants)` of a cached document
+
+    Documents are rendered only once per package (and host name, since they
+    contain absolute URLs) and live in the cache until the index tells us
+    that the package changed. Documents that also depend on the query string
+    tell which of its `params` they use. Returns `None` when `render()`
+    finds nothing. The `variants` dictionary keeps the compressed versions
+    of the body. Documents are saved in `current_app.documents`, unless
+    another cache is informed.
+    """
+    if documents is None:
+        documents = current_app.documents
+    key = endpoint or request.endpoint, package, request.host_url, params
+    document = documents.get(key)
+    if document is None:
+        generation = documents.generation(package)
+        body = render()
+        if body is None:
+            return None
+        body = body.encode('utf-8')
+        document = body, hashlib.sha1(body).hexdigest(), {}
+        documents.set(package, key, document, generation)
+    return document
+
+
+def upstream_listing(package):
+    """Returns the `(stamp, files)` of `package` in the upstream index
+
+    See `Proxy.listing()`. Documents that include the files of the upstream
+    index are cached along with the `stamp`, so they're rendered again when
+    the listing changes. Packages of our own are never looked for upstream.
+    """
+    if not current_app.proxied(package):
+        return None, {}
+    return current_app.proxy.listing(package)
+
+
+def compress(body, encoding):
+    # Adding 16 to the window bits makes zlib write gzip streams. HTTP's
+    # `deflate` is the zlib format (RFC 1950), not raw deflate.
+    wbits = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+    compressor = zlib.compressobj(
+        COMPRESSION_LEVEL, zlib.DEFLATED, wbits[encoding])
+    return compressor.compress(body) + compressor.flush()
+
+
+def send_document(package, render, mimetype='application/json',
+                  params=None, documents=None):
+    """Serves a document rendered by `render()` from the document cache
+
+    Clients that accept it get a compressed version of the document, which
+    is also cached, so each document is compressed once.
+    """
+    document = get_document(
+        package, render, params=params, documents=documents)
+    if document is None:
+        return None
+
+    body, etag, variants = document
+    encoding = len(body) >= MIN_COMPRESS_SIZE and \
+        request.accept_encodings.best_match(COMPRESSED_ENCODINGS)
+    if encoding:
+        if encoding not in variants:
+            variants[encoding] = compress(body, encoding)
+        body = variants[encoding]
+        etag = '{0}-{1}'.format(etag, encoding)
+
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response.make_conditional(request)
 
 
 class HtPasswd(object):
+    """Users and passwords from an htpasswd file
+
+    `crypt()` is slow on purpose, so credentials that passed the check are
+    remembered for `AUTH_CACHE_TTL` seconds. They're saved under an HMAC
+    with a secret that only lives in memory, never in clear text. The file
+    is read again (and the cache cleared) when its mtime changes.
+    """
 
     def __init__(self, path):
         self.path = path
+        self.mtime = None
+        self.secret = os.urandom(32)
+        self.verdicts = OrderedDict()
+        self.lock = Lock()
         self.users = self.load()
 
     def enabled(self):
         return self.path is not None
 
     def auth(self, username, clear_password):
+        self.reload()
+        key = hmac.new(self.secret, '\0'.join(
+            (username, clear_password)).encode('utf-8'),
+            hashlib.sha256).digest()
+        now = time.time()
+        with self.lock:
+            expires = self.verdicts.pop(key, 0)
+            if expires > now:
+                self.verdicts[key] = expires
+                return True
+
         try:
             crypted_passwd = self.users[username]
         except KeyError:
             return False
-        return crypt.crypt(clear_password, crypted_passwd) == crypted_passwd
+        if crypt.crypt(clear_password, crypted_passwd) != crypted_passwd:
+            return False
+
+        with self.lock:
+            self.verdicts[key] = now + AUTH_CACHE_TTL
+            while len(self.verdicts) > AUTH_CACHE_SIZE:
+                self.verdicts.popitem(last=False)
+        return True
+
+    def reload(self):
+        if not self.enabled():
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self.mtime:
+            users = self.load()
+            with self.lock:
+                self.users = users
+                self.verdicts.clear()
 
     def load(self):
         users = {}
         if not self.enabled():
             return users
 
+        self.mtime = os.stat(self.path).st_mtime
         with open(self.path) as fd:
             for line in fd.read().splitlines():
                 line = line.split('#')[0].strip()
@@ -80,39 +416,233 @@ class API(Blueprint):
         auth = Authenticator(user_db)
         self.add_url_rule('/', 'index', auth(self.web_index))
         self.add_url_rule('/<package>', 'package', auth(self.web_package))
+        self.add_url_rule('/', 'batch', auth(self.web_batch), methods=['POST'])
 
     def web_index(self):
-        return json.dumps(current_app.index.list_packages())
+        return send_document(ALL_PACKAGES, lambda: json.dumps(
+            current_app.index.list_packages()))
 
     def web_package(self, package):
-        releases = []
+        stamp, upstream = upstream_listing(package)
+        return send_document(
+            package, partial(self.render_package, package, upstream),
+            params=stamp) or (json.dumps({'status': 'error'}), 404)
+
+    def web_batch(self):
+        """Releases of many packages in a single request
+
+        Receives `{"packages": [...]}`, with either names or requirements,
+        and answers with an object that maps the names found in the index
+        to the same list of releases `/api/<package>` would return.
+        """
+        try:
+            specs = json.loads(request.data.decode('utf-8'))['packages']
+            names = set(parse_requirement(safe_name(s)).name for s in specs)
+        except Exception:
+            return json.dumps({'status': 'error'}), 400
+        if len(names) > MAX_BATCH_SIZE:
+            return json.dumps({'status': 'error'}), 413
+
+        # The upstream index is asked about all the packages at once
+        proxied = [name for name in names if current_app.proxied(name)]
+        if proxied:
+            current_app.proxy.prefetch(proxied)
+
+        # The documents of the packages are already JSON, there's no need to
+        # decode them just to encode them again
+
+        documents = []
+        for name in sorted(names):
+            stamp, upstream = upstream_listing(name)
+            document = get_document(
+                name, partial(self.render_package, name, upstream),
+                'api.package', stamp)
+            if document is not None:
+                documents.append('{0}: {1}'.format(
+                    json.dumps(name), document[0].decode('utf-8')))
+        return Response(
+            '{' + ', '.join(documents) + '}', mimetype='application/json')
+
+    def render_package(self, package, upstream=None):
         fmt = lambda u: url_for('download', package=u, _external=True)
-        for release in current_app.index.package_releases(package, fmt):
-            releases.append(release)
-        if releases:
-            return json.dumps(releases)
-        else:
-            return json.dumps({'status': 'error'}), 404
+        releases = current_app.index.package_releases(package, fmt)
+
+        # Files of the upstream index are downloaded when clients ask for them
+        versions = dict((r['version'], r) for r in releases)
+        local = set(u['url'] for r in releases for u in r['urls'])
+        for file_name, (url, sha256) in sorted((upstream or {}).items()):
+            if fmt(file_name) in local:
+                continue
+            version = pkg_name(file_name)[1]
+            if version not in versions:
+                versions[version] = {
+                    'name': package, 'version': version, 'urls': []}
+                releases.append(versions[version])
+            versions[version]['urls'].append(
+                {'url': fmt(file_name), 'sha256': sha256})
+        return releases and json.dumps(releases) or None
+
+
+class Simple(Blueprint):
+    """The simple repository API described in PEP 503
+
+    Lets pip (or anything else that understands a `--index-url`) install
+    the packages available in this server.
+    """
+
+    def __init__(self, user_db):
+        super(Simple, self).__init__('simple', __name__)
+
+        auth = Authenticator(user_db)
+        self.add_url_rule('/', 'index', auth(self.web_index))
+        self.add_url_rule('/<project>/', 'project', auth(self.web_project))
+
+    def web_index(self):
+        return send_document(ALL_PACKAGES, lambda: render_template(
+            'simple/index.html', projects=sorted(current_app.projects())),
+            mimetype='text/html')
+
+    def web_project(self, project):
+        name = canonical_name(project)
+        if name != project:
+            return redirect(url_for('.project', project=name), 301)
+
+        stamp, upstream = upstream_listing(name)
+
+        def render():
+            index = current_app.index
+            files = dict(
+                (file_name, index.digest(file_name))
+                for package in current_app.projects().get(name, ())
+                for files in index.storage.get(package, {}).values()
+                for file_name in files)
+            for file_name, (url, sha256) in upstream.items():
+                files.setdefault(file_name, sha256)
+            return files and render_template(
+                'simple/project.html', project=name,
+                files=sorted(files.items())) or None
+        return send_document(name, render, mimetype='text/html',
+                             params=stamp) or ('project not found', 404)
 
 
 class App(Flask):
 
-    def __init__(self, index, user_db=None):
+    def __init__(self, index, user_db=None, builds=None, proxy=None):
         super(App, self).__init__(__name__)
 
         self.index = index
+        self.builds = builds
+        self.proxy = proxy
+        self.documents = QueryCache(DOCUMENT_CACHE_SIZE)
+        self.pages = QueryCache(PAGE_CACHE_SIZE)
+        self.index.connect('updated', self.index_updated)
+        self.metrics = Metrics()
+        self.before_request(self.request_started)
+        self.after_request(self.request_finished)
+        self.teardown_request(self.request_closed)
 
         auth = Authenticator(user_db)
 
         self.register_blueprint(API(user_db), url_prefix='/api')
+        self.register_blueprint(Simple(user_db), url_prefix='/simple')
         self.add_url_rule('/', 'index', auth(self.web_index))
         self.add_url_rule('/s/<query>', 'search', auth(self.web_search))
         self.add_url_rule('/p/<package>', 'download', auth(self.web_download))
         self.add_url_rule('/p/<package>', 'upload', auth(self.web_upload),
                           methods=['PUT'])
+        self.add_url_rule('/metrics', 'metrics', auth(self.web_metrics))
+        if self.builds:
+            self.add_url_rule('/b/<package>', 'build', auth(self.web_build),
+                              methods=['GET', 'POST'])
+
+    def request_started(self):
+        g.started = time.time()
+        self.metrics.request_started()
+
+    def request_finished(self, response):
+        # Streamed responses are counted when they start, the time spent
+        # sending the body is not measured
+        self.metrics.request_finished(
+            request.endpoint or 'none', request.method, response.status_code,
+            time.time() - g.started, response.content_length)
+        return response
+
+    def request_closed(self, exception=None):
+        self.metrics.request_closed()
+
+    def index_updated(self, requester, package):
+        self.documents.invalidate(package)
+        self.documents.invalidate(canonical_name(package))
+        self.documents.invalidate(ALL_PACKAGES)
+        self.pages.invalidate(ALL_PACKAGES)
+
+    def projects(self):
+        """Maps PEP 503 project names to the package names in the index"""
+        projects = self.documents.get(PROJECTS)
+        if projects is None:
+            generation = self.documents.generation(ALL_PACKAGES)
+            projects = defaultdict(list)
+            for package in self.index.list_packages():
+                projects[canonical_name(package)].append(package)
+            self.documents.set(ALL_PACKAGES, PROJECTS, projects, generation)
+        return projects
+
+    def proxied(self, package):
+        """Tells if `package` should be looked for in the upstream index
+
+        Only packages we don't have, or that have nothing but files that came
+        from the upstream index. Otherwise anybody could publish a package
+        upstream with the name of a private one and a bigger version.
+        """
+        if self.proxy is None:
+            return False
+        return self.proxy.owns(
+            file_name
+            for name in self.projects().get(canonical_name(package), ())
+            for files in self.index.storage.get(name, {}).values()
+            for file_name in files)
+
+    def packages(self):
+        """Sorted names of the packages in the index"""
+        packages = self.documents.get(PACKAGES)
+        if packages is None:
+            generation = self.documents.generation(ALL_PACKAGES)
+            packages = sorted(self.index.list_packages(),
+                              key=lambda name: name.lower())
+            self.documents.set(ALL_PACKAGES, PACKAGES, packages, generation)
+        return packages
 
     def web_index(self):
-        return render_template('index.html', index=self.index)
+        """Lists the packages of the index, `PAGE_SIZE` at a time
+
+        The `q` parameter keeps only the packages with that text in their
+        names and `page` picks which page of them is shown.
+        """
+        query = request.args.get('q', '').strip().lower()[:MAX_FILTER_SIZE]
+        page = request.args.get('page', 1, type=int)
+
+        def render():
+            packages = self.packages()
+            if query:
+                packages = [p for p in packages if query in p.lower()]
+            pages = max(1, (len(packages) + PAGE_SIZE - 1) // PAGE_SIZE)
+            if not 1 <= page <= pages:
+                return None
+            start = (page - 1) * PAGE_SIZE
+            return render_template(
+                'index.html', packages=packages[start:start + PAGE_SIZE],
+                total=len(packages), start=start, page=page, pages=pages,
+                query=query)
+        return send_document(
+            ALL_PACKAGES, render, mimetype='text/html', params=(page, query),
+            documents=self.pages) or ('page not found', 404)
+
+    def web_metrics(self):
+        return Response(self.metrics.render(self.index, {
+            'query': self.index.cache,
+            'documents': self.documents,
+            'pages': self.pages,
+        }), content_type=METRICS_CONTENT_TYPE)
 
     def web_search(self, query):
         try:
@@ -121,13 +651,25 @@ class App(Flask):
             return 'package not found', 404
         except ValueError:
             return 'your query is wrong', 400
-        return send_file(
-            path, as_attachment=True,
-            attachment_filename=os.path.basename(path))
+        # The answer of a query changes when new releases arrive, caches must
+        # check with us before reusing it
+        return self.send_package(path, attachment=True)
 
     def web_download(self, package):
-        with self.index.open(package) as pkg:
-            return pkg.read()
+        file_name = os.path.basename(package)
+        name = pkg_name(file_name)
+        if name and file_name not in self.index.files and \
+                self.proxied(name[0]):
+            if self.proxy.download(file_name) is False:
+                return 'still downloading from the upstream index', 503
+        return self.send_package(self.index.path(file_name))
+
+    def send_package(self, path, **options):
+        try:
+            digest = self.index.digest(path)
+        except (IOError, OSError):
+            return 'package not found', 404
+        return send_package(path, digest, **options)
 
     def web_upload(self, package):
         """
@@ -136,20 +678,163 @@ class App(Flask):
          * The caller names the package (its basename)
         """
         pkg = request.files[package]
-        self.index.from_data(package, pkg.read())
+        self.index.from_stream(package, pkg.stream)
+        self.metrics.upload_received()
+
+        # Reading the requirements of wheels right away, so they're ready
+        # when clients ask for them
+        self.index.dependencies(package)
+
+        # Nobody else will have to build the wheel of this source package
+        if self.builds:
+            self.builds.queue(os.path.basename(package))
         return 'ok'
 
+    def web_build(self, package):
+        """Status of the job that builds a wheel for a source package
+
+        Clients can `POST` to ask for a build of a package that's already in
+        the index and then poll this URL until the job is either `done` or
+        `failed`, instead of building the package themselves.
+        """
+        package = os.path.basename(package)
+        if request.method == 'POST':
+            job = self.builds.queue(package)
+        else:
+            job = self.builds.get(package)
+        if not job:
+            return json.dumps({'status': 'error'}), 404
+
+        # Only jobs that are still going on were accepted for later
+        accepted = request.method == 'POST' and \
+            job['status'] in ('queued', 'building')
+        return Response(json.dumps(job), mimetype='application/json',
+                        status=202 if accepted else 200)
+
 
 class Server(object):
 
-    def __init__(self, curddir, user_db):
-        index = Index(curddir)
+    def __init__(self, curddir, user_db, sharded=False,
+                 refresh_interval=POLL_INTERVAL, build_workers=0,
+                 replicate_from=None,
+                 replication_interval=REPLICATION_INTERVAL,
+                 upstream=None):
+        index = (ShardedIndex if sharded else Index)(curddir)
         index.scan()
 
-        self.app = App(index, user_db)
+        # Files might be added to (or removed from) the curddir by other
+        # processes while we're running
+        self.watcher = refresh_interval and Watcher(index, refresh_interval)
+
+        # Wheels for the source packages we receive can be built here
+        self.builds = build_workers and Builds(index, build_workers)
+
+        # Packages of other servers can be copied to ours
+        self.replicator = replicate_from and Replicator(
+            index, replicate_from, interval=replication_interval)
+
+        # Packages we don't have can be looked for in another index
+        self.proxy = upstream and Proxy(index, upstream)
+
+        self.app = App(index, user_db, self.builds, self.proxy)
+        self.logger = logger(__name__)
 
-    def start(self, host='0.0.0.0', port=8000, debug=False):
+    def start(self, host='0.0.0.0', port=8000, debug=False, workers=1):
         if debug:
+            self.start_threads(replicate=True)
             self.app.run(host=host, port=port, debug=True)
+        elif workers > 1:
+            self.prefork(self.listen(host, port), workers)
         else:
-            WSGIServer((host, port), self.app).serve_forever()
+            self.start_threads(replicate=True)
+            self.serve((host, port))
+
+    def serve(self, listener):
+        WSGIServer(listener, self.app).serve_forever()
+
+    def start_threads(self, replicate=False):
+        if self.watcher:
+            self.watcher.start()
+        if self.builds:
+            self.builds.start()
+        if self.proxy:
+            self.proxy.start()
+        if self.replicator and replicate:
+            self.replicator.start()
+
+    def listen(self, host, port):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen(LISTEN_BACKLOG)
+        return listener
+
+    def prefork(self, listener, workers):
+        """Serve the requests accepted by `listener` with many processes
+
+        The index is scanned once, before forking, and each worker keeps its
+        copy in sync with the directory using its own `Watcher`. So packages
+        uploaded through one worker are seen by the others as well. Workers
+        that die are replaced until we're told to stop.
+
+        Replication runs in a process of its own, otherwise every worker
+        would download the same files.
+        """
+        def stop(signum, frame):
+            raise SystemExit(0)
+        signal.signal(signal.SIGTERM, stop)
+
+        def worker():
+            self.start_threads()
+            self.serve(listener)
+
+        targets = [worker] * workers
+        if self.replicator:
+            targets.append(self.replicator.run)
+
+        pids = {}
+        try:
+            for target in targets:
+                pids[self.fork(target)] = target
+            while True:
+                try:
+                    pid, status = os.wait()
+                except OSError as exc:
+                    if exc.errno != errno.EINTR:
+                        raise
+                    continue
+                target = pids.pop(pid, None)
+                if target is None or not status:
+                    # Only a replication pass that ran once exits cleanly
+                    continue
+                self.logger.warning(
+                    'Worker %d exited with status %d, replacing it',
+                    pid, status)
+                pids[self.fork(target)] = target
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+    def fork(self, target):
+        pid = os.fork()
+        if pid:
+            return pid
+
+        # The event loop of the parent can't be shared with the child. And
+        # threads don't survive the fork, so `target` has to start them.
+        reinit()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        status = 1
+        try:
+            target()
+            status = 0
+        except BaseException:
+            self.logger.exception('Worker %d failed', os.getpid())
+        finally:
+            os._exit(status)
@@ -1,5 +1,7 @@
 from __future__ import absolute_import, print_function, unicode_literals
 from curdling.web import Server
+from curdling.web.watcher import POLL_INTERVAL
+from curdling.web.replication import REPLICATION_INTERVAL
 
 import argparse
 
@@ -28,13 +30,57 @@ def parse_args():
         '-u', '--user-db',
         help='An htpasswd-compatible file saying who can access your curd server')
 
-    return parser.parse_args()
+    parser.add_argument(
+        '-s', '--sharded', action='store_true', default=False,
+        help='Store packages in hashed subdirectories of the cache directory')
+
+    parser.add_argument(
+        '-r', '--refresh-interval', type=float, default=POLL_INTERVAL,
+        help='Max seconds before noticing files changed by other processes. '
+        'Use 0 to disable')
+
+    parser.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help='Number of processes serving requests')
+
+    parser.add_argument(
+        '-b', '--build-workers', type=int, default=0,
+        help='Build wheels for uploaded source packages using this many '
+        'threads. Use 0 to disable')
+
+    parser.add_argument(
+        '-R', '--replicate-from', action='append', metavar='URL',
+        help='Copy the packages of another curdling server. Can be used '
+        'more than once')
+
+    parser.add_argument(
+        '-i', '--replication-interval', type=float,
+        default=REPLICATION_INTERVAL,
+        help='Seconds between two checks for new packages in the servers '
+        'we replicate from. Use 0 to check only once')
+
+    parser.add_argument(
+        '-U', '--upstream', metavar='URL',
+        help='Download the packages clients ask for and the server does not '
+        'have from this index, like https://pypi.python.org/simple/')
+
+    args = parser.parse_args()
+
+    # Workers only see the uploads received by the others when they keep
+    # their indexes in sync with the directory
+    if args.workers > 1 and not args.refresh_interval:
+        parser.error('--refresh-interval must not be 0 with more than one '
+                     'worker')
+    return args
 
 
 def main():
     args = parse_args()
-    server = Server(args.curddir, args.user_db)
-    server.start(args.host, args.port, args.debug)
+    server = Server(args.curddir, args.user_db, args.sharded,
+                    args.refresh_interval, args.build_workers,
+                    args.replicate_from, args.replication_interval,
+                    args.upstream)
+    server.start(args.host, args.port, args.debug, args.workers)
 
 
 if __name__ == '__main__':
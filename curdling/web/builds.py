@@ -0,0 +1,178 @@
+from __future__ import absolute_import, print_function, unicode_literals
+
+from ..index import META_DIR
+from ..services.curdler import Curdler
+
+import io
+import os
+import json
+import errno
+import tempfile
+
+
+# How many finished jobs we remember, so clients can still ask about them
+BUILD_HISTORY_SIZE = 1024
+
+# Directory (inside of the `META_DIR` of the index) with the jobs
+BUILDS_DIR = 'builds'
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+class Builds(object):
+    """Builds wheels for the source packages of the index
+
+    Jobs are handled by a `Curdler` service with `size` threads, the same
+    one `curd install` uses, and the wheels it builds land in the index. A
+    job is identified by the requirement of its package, so each version
+    is built only once, no matter how many clients ask for it.
+
+    Each job is saved in a small JSON file under `.curdling/builds`, so all
+    the workers of the pre-fork mode know about the jobs of the others. The
+    process that manages to create the file of a job is the one that builds
+    it, and jobs of processes that died count as failed.
+    """
+
+    def __init__(self, index, size):
+        self.index = index
+        self.directory = os.path.join(index.base_path, META_DIR, BUILDS_DIR)
+        self.curdler = Curdler(size=size, index=index)
+        self.curdler.connect('started', self.job_started)
+        self.curdler.connect('finished', self.job_finished)
+        self.curdler.connect('failed', self.job_failed)
+
+    def start(self):
+        self.curdler.start()
+        return self
+
+    def requirement(self, file_name):
+        record = self.index.files.get(file_name)
+        if record is None or record['format'] == 'whl':
+            return None
+        return '{0}=={1}'.format(record['name'], record['version'])
+
+    def has_wheel(self, requirement):
+        name, version = requirement.split('==')
+        return any(f.endswith('.whl') for f in
+                   self.index.storage.get(name, {}).get(version, []))
+
+    def path(self, requirement):
+        return os.path.join(self.directory, requirement + '.json')
+
+    def get(self, file_name):
+        requirement = self.requirement(file_name)
+        job = requirement and self.load(requirement)
+        return job and self.public(job)
+
+    def queue(self, file_name):
+        """Build a wheel for the source package `file_name`
+
+        Returns the job, or `None` if the file is not a source package of
+        the index. Packages that already have a wheel are not built again,
+        unless the previous job failed.
+        """
+        requirement = self.requirement(file_name)
+        if requirement is None:
+            return None
+        previous = self.load(requirement)
+        if previous and previous['status'] != 'failed':
+            return self.public(previous)
+
+        job = {
+            'requirement': requirement,
+            'tarball': file_name,
+            'status': 'queued',
+            'wheel': None,
+            'error': None,
+            'pid': os.getpid(),
+        }
+        if self.has_wheel(requirement):
+            job['status'] = 'done'
+        if not self.save(requirement, job, replace=previous is not None):
+            # Another worker was faster than us
+            return self.get(file_name)
+
+        self.prune()
+        if job['status'] == 'queued':
+            self.curdler.queue('server', requirement=requirement,
+                               tarball=self.index.path(file_name))
+        return self.public(job)
+
+    def public(self, job):
+        return dict((k, v) for k, v in job.items() if k != 'pid')
+
+    def load(self, requirement):
+        try:
+            with io.open(self.path(requirement), 'rb') as fobj:
+                job = json.loads(fobj.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+        if job['status'] in ('queued', 'building') and not alive(job['pid']):
+            job.update(status='failed', error='the build was interrupted')
+        return job
+
+    def save(self, requirement, job, replace=True):
+        """Write the file of a job atomically
+
+        Returns `False` when `replace` is not set and the job already has
+        a file, written by another thread or process.
+        """
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+        except OSError:
+            if not os.path.isdir(self.directory):
+                raise
+        fd, temp = tempfile.mkstemp(prefix='.', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as fobj:
+                fobj.write(json.dumps(job).encode('utf-8'))
+            if replace:
+                os.rename(temp, self.path(requirement))
+                return True
+            try:
+                os.link(temp, self.path(requirement))
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+                return False
+            return True
+        finally:
+            if os.path.exists(temp):
+                os.unlink(temp)
+
+    def prune(self):
+        # Other processes might be pruning too, so files can disappear from
+        # under our feet. It's just housekeeping, we'll try again next time.
+        try:
+            jobs = [os.path.join(self.directory, f)
+                    for f in os.listdir(self.directory)
+                    if not f.startswith('.')]
+            if len(jobs) <= BUILD_HISTORY_SIZE:
+                return
+            jobs.sort(key=lambda path: os.stat(path).st_mtime)
+            for path in jobs[:len(jobs) - BUILD_HISTORY_SIZE]:
+                os.unlink(path)
+        except OSError:
+            pass
+
+    def update(self, requirement, **fields):
+        job = self.load(requirement)
+        if job is not None:
+            job.update(fields)
+            self.save(requirement, job)
+
+    def job_started(self, requester, requirement, **data):
+        self.update(requirement, status='building')
+
+    def job_finished(self, requester, requirement, wheel, **data):
+        self.update(requirement, status='done', wheel=os.path.basename(wheel))
+
+    def job_failed(self, requester, requirement, exception, **data):
+        self.update(requirement, status='failed', error=str(exception))
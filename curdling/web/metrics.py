@@ -0,0 +1,169 @@
+from __future__ import absolute_import, print_function, unicode_literals
+from collections import defaultdict
+from threading import Lock
+
+import os
+import bisect
+
+
+# Upper bounds (in seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Content type of the text format understood by Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Methods counted by their names. Clients can send anything as the method
+# of a request, so all the others share the same label instead of creating
+# new series.
+KNOWN_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH')
+OTHER_METHOD = 'other'
+
+
+def escape(value):
+    return '{0}'.format(value).replace('\\', '\\\\').replace(
+        '\n', '\\n').replace('"', '\\"')
+
+
+def labels(**values):
+    if not values:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, escape(value))
+                          for name, value in sorted(values.items())) + '}'
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def render(self, name, **values):
+        lines = []
+        count = 0
+        for bound, bucket in zip(self.buckets + ('+Inf',), self.counts):
+            count += bucket
+            lines.append('{0}_bucket{1} {2}'.format(
+                name, labels(le=bound, **values), count))
+        values = labels(**values)
+        lines.append('{0}_sum{1} {2}'.format(name, values, self.total))
+        lines.append('{0}_count{1} {2}'.format(name, values, count))
+        return lines
+
+
+class Metrics(object):
+    """Counts what the server does, for the `/metrics` endpoint
+
+    Recording a request is just a few dictionary updates under a lock. The
+    numbers that the index and the caches already keep are only collected
+    when the metrics are rendered.
+
+    Every series has a `worker` label with the pid of the process, since
+    each worker of the pre-fork mode counts its own requests and scrapes
+    land on any of them.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.requests = defaultdict(int)
+        self.latencies = defaultdict(Histogram)
+        self.bytes_served = defaultdict(int)
+        self.uploads = 0
+        self.in_flight = 0
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def request_finished(self, endpoint, method, status, duration, size):
+        if method not in KNOWN_METHODS:
+            method = OTHER_METHOD
+        with self.lock:
+            self.requests[endpoint, method, status] += 1
+            self.latencies[endpoint].observe(duration)
+            if size:
+                self.bytes_served[endpoint] += size
+
+    def request_closed(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def upload_received(self):
+        with self.lock:
+            self.uploads += 1
+
+    def render(self, index, caches):
+        """Prometheus text format of the metrics
+
+        `caches` maps names to objects with a `stats()` method, like the
+        `QueryCache`.
+        """
+        out = []
+        worker = os.getpid()
+        metric = lambda name, kind, text: out.extend([
+            '# HELP {0} {1}'.format(name, text),
+            '# TYPE {0} {1}'.format(name, kind)])
+
+        with self.lock:
+            metric('curdling_http_requests_total', 'counter',
+                   'Requests handled, per route, method and status.')
+            for (endpoint, method, status), count in sorted(
+                    self.requests.items()):
+                out.append('curdling_http_requests_total{0} {1}'.format(
+                    labels(route=endpoint, method=method, status=status,
+                           worker=worker), count))
+
+            metric('curdling_http_request_duration_seconds', 'histogram',
+                   'Time spent to build the responses, per route.')
+            for endpoint, histogram in sorted(self.latencies.items()):
+                out.extend(histogram.render(
+                    'curdling_http_request_duration_seconds', route=endpoint,
+                    worker=worker))
+
+            metric('curdling_http_response_bytes_total', 'counter',
+                   'Bytes sent in response bodies, per route.')
+            for endpoint, size in sorted(self.bytes_served.items()):
+                out.append('curdling_http_response_bytes_total{0} {1}'.format(
+                    labels(route=endpoint, worker=worker), size))
+
+            metric('curdling_http_requests_in_flight', 'gauge',
+                   'Requests being handled right now.')
+            out.append('curdling_http_requests_in_flight{0} {1}'.format(
+                labels(worker=worker), self.in_flight))
+
+            metric('curdling_uploads_total', 'counter',
+                   'Packages uploaded to the server.')
+            out.append('curdling_uploads_total{0} {1}'.format(
+                labels(worker=worker), self.uploads))
+
+        storage = dict(index.storage)
+        metric('curdling_index_packages', 'gauge',
+               'Packages available in the index.')
+        out.append('curdling_index_packages{0} {1}'.format(
+            labels(worker=worker), len(storage)))
+        metric('curdling_index_files', 'gauge',
+               'Files available in the index, per package.')
+        for package, versions in sorted(storage.items()):
+            out.append('curdling_index_files{0} {1}'.format(
+                labels(package=package, worker=worker),
+                sum(len(files) for files in versions.values())))
+
+        stats = dict((name, cache.stats()) for name, cache in caches.items())
+        for name, field, kind, text in (
+                ('curdling_cache_hits_total', 'hits', 'counter',
+                 'Lookups answered by the cache.'),
+                ('curdling_cache_misses_total', 'misses', 'counter',
+                 'Lookups the cache could not answer.'),
+                ('curdling_cache_entries', 'size', 'gauge',
+                 'Entries kept in the cache.')):
+            metric(name, kind, text)
+            for cache in sorted(stats):
+                out.append('{0}{1} {2}'.format(
+                    name, labels(cache=cache, worker=worker),
+                    stats[cache][field]))
+
+        return '\n'.join(out) + '\n'
@@ -0,0 +1,216 @@
+from __future__ import absolute_import, print_function, unicode_literals
+from distlib import compat
+from distlib.compat import OrderedDict
+from threading import Event, Lock
+
+from ..index import FORMATS, META_DIR, pkg_name
+from ..services.base import Service
+from ..services.downloader import Downloader, PyPiLocator
+from ..util import canonical_name, split_name
+
+import io
+import os
+import time
+import gevent
+
+
+# Seconds the listing of a project in the upstream index is trusted before
+# we ask for it again. Projects the upstream index doesn't have are
+# remembered for the same time.
+PROXY_LISTING_TTL = 300
+
+# How many listings are kept in memory
+PROXY_LISTING_CACHE_SIZE = 4096
+
+# Seconds a request waits for the upstream index. Downloads that take longer
+# go on in the background, so the client can just try again later.
+PROXY_TIMEOUT = 30
+
+# Threads talking to the upstream index
+PROXY_WORKERS = 4
+
+# Seconds between two checks of a request waiting for the upstream index
+PROXY_POLL_INTERVAL = 0.05
+
+# File (inside of the `META_DIR` of the index) with the names of the files
+# downloaded from the upstream index, one per line
+UPSTREAM_FILES_NAME = 'upstream'
+
+
+def wait(events, timeout):
+    """Wait for `threading.Event`s without blocking the other requests
+
+    The server doesn't monkey patch anything, so blocking on the events
+    would stop the whole gevent loop. Sleeping lets the other greenlets run
+    while the threads of the proxy talk to the upstream index.
+    """
+    deadline = time.time() + timeout
+    while not all(event.is_set() for event in events):
+        if time.time() >= deadline:
+            return False
+        gevent.sleep(PROXY_POLL_INTERVAL)
+    return True
+
+
+class Proxy(Service):
+    """Serves the packages of an upstream index as if they were ours
+
+    The listing of a project in the upstream index (anything `PyPiLocator`
+    can read, like PyPI itself) is fetched when a client asks for it, and
+    its files are only downloaded to our index when a client asks for them.
+    All the talking to the upstream index happens in the threads of the
+    service. Concurrent requests for the same listing or file wait for a
+    single job instead of going upstream again.
+
+    Projects with files that didn't come from the upstream index are ours
+    (see `owns()`), and the upstream index must never add files to them.
+    Downloads that don't match the digest of the listing are thrown away.
+    """
+
+    def __init__(self, index, url, size=PROXY_WORKERS, timeout=PROXY_TIMEOUT):
+        super(Proxy, self).__init__(size=size, index=index)
+        self.url = url if url.endswith('/') else url + '/'
+        self.timeout = timeout
+        self.downloader = Downloader(index=index, conf={})
+        self.lock = Lock()
+        self.jobs = {}
+        self.listings = OrderedDict()
+        self.files = set()
+        self.files_stat = None
+
+    def listing(self, name):
+        """Returns `(stamp, files)` for the project `name`
+
+        The `files` dictionary maps the file names of the project in the
+        upstream index to their `(url, sha256)`. The `stamp` changes every
+        time the listing is fetched again. An old listing is returned right
+        away while a new one is fetched in the background, and an empty one
+        when the upstream index takes too long to answer the first time.
+        """
+        self.prefetch([name])
+        return self.listings.get(canonical_name(name), (None, None, {}))[1:]
+
+    def prefetch(self, names):
+        """Fetch the listings of many projects at once"""
+        events = []
+        for name in names:
+            project = canonical_name(name)
+            expires, _, _ = self.listings.get(project, (0, None, None))
+            if expires > time.time():
+                continue
+            event = self.submit(('listing', project), project=project)
+            if not expires:
+                events.append(event)
+        wait(events, self.timeout)
+
+    def download(self, file_name):
+        """Bring `file_name` from the upstream index to ours
+
+        Returns `None` if the upstream index doesn't have the file (or sent
+        something else) and `False` if it couldn't be downloaded within the
+        timeout.
+        """
+        name = pkg_name(file_name)
+        if not name:
+            return None
+        if file_name in self.index.files:
+            # Another request was faster than us
+            return True
+        info = self.listing(name[0])[1].get(file_name)
+        if info is None:
+            return None
+        event = self.submit(('file', file_name), file_name=file_name,
+                            url=info[0], sha256=info[1])
+        if not wait([event], self.timeout):
+            return False
+        return file_name in self.index.files or None
+
+    def owns(self, files):
+        """Tells if all the `files` were downloaded from the upstream index"""
+        downloaded = self.downloaded()
+        return all(f in downloaded for f in files)
+
+    def files_path(self):
+        return os.path.join(
+            self.index.base_path, META_DIR, UPSTREAM_FILES_NAME)
+
+    def downloaded(self):
+        # The file is shared by all the workers of the server, so it's read
+        # again whenever one of them adds something to it
+        path = self.files_path()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return self.files
+        if (stat.st_size, stat.st_mtime) != self.files_stat:
+            try:
+                with io.open(path, 'rb') as fobj:
+                    files = set(fobj.read().decode('utf-8').split())
+            except (IOError, OSError):
+                return self.files
+            self.files, self.files_stat = files, (stat.st_size, stat.st_mtime)
+        return self.files
+
+    def remember(self, file_name):
+        with io.open(self.index.ensure_path(self.files_path()), 'ab') as fobj:
+            fobj.write('{0}\n'.format(file_name).encode('utf-8'))
+        self.files = self.files | set([file_name])
+
+    def submit(self, key, **data):
+        # Jobs for the same listing or file are never queued twice
+        with self.lock:
+            event = self.jobs.get(key)
+            if event is None:
+                event = self.jobs[key] = Event()
+                self.queue('proxy', key=key, **data)
+        return event
+
+    def handle(self, requester, data):
+        try:
+            if data.get('project'):
+                self.fetch_listing(data['project'])
+            else:
+                self.fetch_file(data['file_name'], data['url'], data['sha256'])
+        finally:
+            with self.lock:
+                self.jobs.pop(data['key']).set()
+        return {}
+
+    def fetch_file(self, file_name, url, sha256):
+        # Remembered before the file shows up in the index, so its project
+        # is never mistaken for one of ours
+        self.remember(file_name)
+        _, path = self.downloader.download(url, self.url)
+        file_name = os.path.basename(path)
+        if sha256 and self.index.digest(file_name) != sha256:
+            self.logger.error('Digest of %s does not match the one informed '
+                              'by the upstream index, removing it', file_name)
+            self.index.unindex(file_name)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def fetch_listing(self, project):
+        files = {}
+        locator = PyPiLocator(self.url)
+        page = locator.get_page(compat.urljoin(self.url, project + '/'))
+        if page is None and project in self.listings:
+            # The upstream index is unreachable, what we knew is still good
+            files = self.listings[project][2]
+        for link, rel in (page and page.links or []):
+            url, _, fragment = link.partition('#')
+            file_name = compat.unquote(
+                os.path.basename(compat.urlparse(url).path))
+            if not pkg_name(file_name) or \
+                    split_name(file_name)[1] not in FORMATS:
+                continue
+            sha256 = fragment[7:] if fragment.startswith('sha256=') else None
+            files[file_name] = url, sha256
+
+        with self.lock:
+            self.listings.pop(project, None)
+            self.listings[project] = \
+                time.time() + PROXY_LISTING_TTL, time.time(), files
+            while len(self.listings) > PROXY_LISTING_CACHE_SIZE:
+                self.listings.popitem(last=False)
@@ -0,0 +1,167 @@
+from __future__ import absolute_import, print_function, unicode_literals
+from distlib import compat
+from threading import Condition, Thread
+
+from ..services.downloader import Downloader, get_opener, http_retrieve
+from ..util import logger, get_auth_info_from_url
+
+import json
+import os
+import time
+import urllib3
+
+
+# Seconds between two passes over the servers we replicate from
+REPLICATION_INTERVAL = 300
+
+# Number of artifacts downloaded at the same time
+REPLICATION_WORKERS = 4
+
+# How many packages we ask about in each request to the batch endpoint of
+# the other servers. Must not be bigger than their `MAX_BATCH_SIZE`.
+REPLICATION_BATCH_SIZE = 500
+
+
+class Replicator(object):
+    """Copies the packages of other curdling servers to our index
+
+    Each pass lists the packages of a server through its API, compares the
+    files it has with the ones in our index and downloads only the missing
+    ones, using a `Downloader` service with `size` threads. Files are saved
+    atomically by the index, so a pass that is interrupted just continues
+    where it stopped the next time.
+    """
+
+    def __init__(self, index, urls, size=REPLICATION_WORKERS,
+                 interval=REPLICATION_INTERVAL):
+        self.index = index
+        self.urls = urls
+        self.interval = interval
+        self.logger = logger(__name__)
+        self.opener = get_opener()
+        self.pending = 0
+        self.expected = {}
+        self.condition = Condition()
+        self.downloader = Downloader(size=size, index=index, conf={})
+        self.downloader.connect('finished', self.download_finished)
+        self.downloader.connect('failed', self.download_failed)
+
+    def start(self):
+        thread = Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def run(self):
+        self.downloader.start()
+        while True:
+            for url in self.urls:
+                try:
+                    self.replicate(url)
+                except Exception:
+                    self.logger.exception('Failed to replicate %s', url)
+            if not self.interval:
+                break
+            time.sleep(self.interval)
+
+    def replicate(self, url):
+        """Download the files of the server `url` that we don't have
+
+        Files we have with another content than the one of the server are
+        downloaded again as well. Servers don't always know the digests of
+        their files (like the ones a proxy didn't download yet), so those
+        are only downloaded when we don't have them.
+        """
+        missing = {}
+        for release in self.releases(url):
+            for info in release['urls']:
+                file_name = os.path.basename(info['url'])
+                digest = self.local_digest(file_name)
+                if digest is None or \
+                        info.get('sha256') not in (None, digest):
+                    missing[file_name] = release['name'], info
+
+        self.logger.info('%d files missing from %s', len(missing), url)
+        with self.condition:
+            self.pending += len(missing)
+            for file_name, (name, info) in missing.items():
+                self.expected[file_name] = info.get('sha256')
+                self.downloader.queue(
+                    'replicator', requirement=name, url=info['url'],
+                    locator_url=url)
+            while self.pending:
+                self.condition.wait()
+
+    def local_digest(self, file_name):
+        if file_name not in self.index.files:
+            return None
+        try:
+            return self.index.digest(file_name)
+        except (IOError, OSError):
+            return None
+
+    def releases(self, url):
+        names = self.get(url, 'api/')
+        for start in range(0, len(names), REPLICATION_BATCH_SIZE):
+            batch = names[start:start + REPLICATION_BATCH_SIZE]
+            projects = self.post(url, 'api/', {'packages': batch})
+            if projects is None:
+                # The server doesn't know the batch endpoint yet
+                projects = dict((n, self.get(url, 'api/' + n)) for n in batch)
+            for releases in projects.values():
+                for release in releases or []:
+                    yield release
+
+    def get(self, url, path):
+        response, _ = http_retrieve(self.opener, compat.urljoin(url, path))
+        if response.status != 200:
+            return None
+        return json.loads(response.data.decode('utf-8'))
+
+    def post(self, url, path, data):
+        headers = get_auth_info_from_url(url)
+        headers['Content-Type'] = 'application/json'
+        try:
+            response = self.opener.request(
+                'POST', compat.urljoin(url, path),
+                body=json.dumps(data), headers=headers)
+        except urllib3.exceptions.HTTPError:
+            return None
+        if response.status != 200:
+            return None
+        return json.loads(response.data.decode('utf-8'))
+
+    def download_finished(self, requester, **data):
+        # Nobody else catches the exceptions of signal handlers, and
+        # `replicate()` would wait forever if we didn't call `done()`
+        try:
+            path = data.get('wheel') or data.get('tarball')
+            file_name = os.path.basename(path)
+            expected = self.expected.pop(file_name, None)
+            if expected and self.local_digest(file_name) != expected:
+                self.logger.error('Digest of %s does not match the one '
+                                  'informed by the server, removing it',
+                                  file_name)
+                self.remove(file_name)
+        except Exception:
+            self.logger.exception('Failed to check %s', data)
+        finally:
+            self.done()
+
+    def remove(self, file_name):
+        # It will be downloaded again in the next pass
+        self.index.unindex(file_name)
+        try:
+            os.unlink(self.index.path(file_name))
+        except OSError:
+            pass
+
+    def download_failed(self, requester, **data):
+        self.logger.error('Failed to download %s: %s',
+                          data.get('url'), data.get('exception'))
+        self.done()
+
+    def done(self):
+        with self.condition:
+            self.pending -= 1
+            self.condition.notify_all()
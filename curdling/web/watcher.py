@@ -0,0 +1,133 @@
+from __future__ import absolute_import, print_function, unicode_literals
+from ..util import logger
+
+import ctypes
+import ctypes.util
+import os
+import select
+import threading
+import time
+
+
+# Events that might change the list of files of a directory. See inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# Default number of seconds between two checks when inotify is not available
+POLL_INTERVAL = 2
+
+# Time we wait for other events to arrive after receiving one, so a burst of
+# changes (like an rsync) triggers only one refresh.
+SETTLE_TIME = 0.2
+
+
+class Inotify(object):
+    """Tiny wrapper around the inotify(7) API of the Linux kernel
+
+    We don't need to know what changed, the index finds that out by itself.
+    This class just tells when it's worth asking.
+    """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init() failed')
+        self.watched = set()
+
+    def watch(self, path):
+        if path in self.watched:
+            return
+        if self.libc.inotify_add_watch(
+                self.fd, path.encode('utf-8'), IN_MASK) < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch() failed')
+        self.watched.add(path)
+
+    def wait(self, timeout):
+        # Returns True if something happened before the timeout. All the
+        # pending events are consumed.
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if not readable:
+            return False
+        time.sleep(SETTLE_TIME)
+        while select.select([self.fd], [], [], 0)[0]:
+            os.read(self.fd, 65536)
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+    """Keeps an `Index` in sync with its directory in a background thread
+
+    Uses inotify when available and falls back to calling `Index.refresh()`
+    every `interval` seconds, which is cheap since the index only lists
+    directories that changed.
+    """
+
+    def __init__(self, index, interval=POLL_INTERVAL):
+        self.index = index
+        self.interval = interval
+        self.logger = logger(__name__)
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def get_inotify(self):
+        try:
+            return Inotify()
+        except (AttributeError, OSError, TypeError):
+            self.logger.debug('inotify not available, polling every %ss',
+                              self.interval)
+            return None
+
+    def run(self):
+        inotify = self.get_inotify()
+        try:
+            while self.running:
+                # New directories (like the shards of the ShardedIndex) might
+                # show up at any time
+                if inotify:
+                    try:
+                        for path in self.directories():
+                            inotify.watch(path)
+                    except OSError:
+                        inotify.close()
+                        inotify = None
+                if inotify:
+                    inotify.wait(self.interval)
+                else:
+                    time.sleep(self.interval)
+                self.refresh()
+        finally:
+            if inotify:
+                inotify.close()
+
+    def directories(self):
+        # The base path is always watched, that's where the directories of
+        # the index will be created if they don't exist yet
+        if not os.path.isdir(self.index.base_path):
+            return []
+        return set([self.index.base_path] + self.index.directories())
+
+    def refresh(self):
+        try:
+            self.index.refresh()
+        except Exception:
+            self.logger.exception('Failed to refresh the index')
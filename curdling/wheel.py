@@ -16,10 +16,87 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import sys
 import email
+import platform
 import zipfile
 from .version import __version__
 
+try:
+    import sysconfig
+except ImportError:  # Python 2.6
+    sysconfig = None
+
+
+# Abbreviations of the python implementations used in wheel tags (PEP-0425)
+IMPLEMENTATIONS = {
+    'CPython': 'cp',
+    'PyPy': 'pp',
+    'IronPython': 'ip',
+    'Jython': 'jy',
+}
+
+
+def get_platform():
+    if sysconfig is not None:
+        name = sysconfig.get_platform()
+    else:
+        from distutils.util import get_platform as distutils_get_platform
+        name = distutils_get_platform()
+    return name.replace('-', '_').replace('.', '_')
+
+
+def get_abi(impl):
+    soabi = sysconfig and sysconfig.get_config_var('SOABI')
+    if soabi and soabi.startswith('cpython-'):
+        return 'cp' + soabi.split('-')[1]
+    if impl == 'cp':
+        # Python 2 doesn't have the SOABI variable
+        return 'cp{0}{1}m{2}'.format(
+            sys.version_info[0], sys.version_info[1],
+            'u' if sys.maxunicode == 0x10ffff else '')
+    return None
+
+
+def get_arches():
+    arch = get_platform()
+    arches = [arch]
+    if arch.startswith('linux_') and platform.libc_ver()[0] == 'glibc':
+        machine = arch[len('linux_'):]
+        arches.extend('{0}_{1}'.format(m, machine)
+                      for m in ('manylinux2014', 'manylinux2010', 'manylinux1'))
+    return arches
+
+
+def supported_tags():
+    """Wheel tags the running interpreter can install, best ones first
+
+    Each tag is a `(pyver, abi, arch)` tuple. Just like in `TagBag`, the
+    values `none` and `any` are represented by `None`.
+    """
+    major, minor = sys.version_info[:2]
+    impl = IMPLEMENTATIONS.get(platform.python_implementation(), 'cp')
+    versions = ['{0}{1}'.format(major, m) for m in range(minor, -1, -1)]
+    abi = get_abi(impl)
+    arches = get_arches()
+
+    tags = []
+    for arch in arches:
+        if abi:
+            tags.append((impl + versions[0], abi, arch))
+        if impl == 'cp' and major == 3:
+            tags.extend(('cp' + v, 'abi3', arch) for v in versions)
+        tags.append((impl + versions[0], None, arch))
+        tags.append(('py' + versions[0], None, arch))
+        tags.append(('py{0}'.format(major), None, arch))
+
+    # Platform independent wheels
+    tags.append((impl + versions[0], None, None))
+    tags.append(('py' + versions[0], None, None))
+    tags.append(('py{0}'.format(major), None, None))
+    tags.extend(('py' + v, None, None) for v in versions[1:])
+    return tags
+
 
 class TagBag(dict):
     def __init__(self, *args, **kwargs):
@@ -85,6 +162,14 @@ class Wheel(object):
             self.tags.arch or 'any',
         ]) for pyver in self.tags.pyver.split('.')]
 
+    def all_tags(self):
+        """Expand the compressed tag sets into `(pyver, abi, arch)` tuples"""
+        split = lambda tag: tag.split('.') if tag else [None]
+        return [(pyver, abi, arch)
+                for pyver in split(self.tags.pyver)
+                for abi in split(self.tags.abi)
+                for arch in split(self.tags.arch)]
+
     def info(self):
         info = {
             'Wheel-Version': '1.0',  # Shamelessly hardcoded
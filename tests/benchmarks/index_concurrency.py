@@ -0,0 +1,81 @@
+# Curdling - Concurrent package manager for Python
+#
+# Copyright (C) 2013-2014  Lincoln Clarete <lincoln@clarete.li>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Lookup throughput of `Index` while other threads keep adding packages
+
+Run it with `python -m tests.benchmarks.index_concurrency`.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+from curdling.index import Index, PackageNotFound
+
+import threading
+import time
+
+PACKAGES = 500
+VERSIONS = 20
+DURATION = 2.0
+
+
+def fill(index, start, step):
+    for version in range(start, VERSIONS, step):
+        for package in range(PACKAGES):
+            index.index('pkg{0}-0.{1}.tar.gz'.format(package, version))
+
+
+def lookups(index, results, stop):
+    count = 0
+    queries = ['pkg{0} (>= 0.{1})'.format(p, p % VERSIONS)
+               for p in range(PACKAGES)]
+    while not stop.is_set():
+        for query in queries:
+            try:
+                index.get(query)
+            except PackageNotFound:
+                pass
+            count += 1
+        for package in index.list_packages():
+            sum(len(files) for files in index.storage[package].values())
+    results.append(count)
+
+
+def run(readers, writers, cache_size):
+    index = Index('', cache_size=cache_size)
+    fill(index, 0, VERSIONS)
+
+    results = []
+    stop = threading.Event()
+    threads = [threading.Thread(target=lookups, args=(index, results, stop))
+               for _ in range(readers)]
+    threads += [threading.Thread(target=fill, args=(index, i + 1, writers))
+                for i in range(writers)]
+    [t.start() for t in threads]
+    time.sleep(DURATION)
+    stop.set()
+    [t.join() for t in threads]
+    return sum(results) / DURATION
+
+
+def main():
+    for cache_size in (0, 4096):
+        for writers in (0, 2):
+            print('readers=4 writers={0} cache={1}: {2:>10.0f} lookups/s'.format(
+                writers, cache_size, run(4, writers, cache_size)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,14 @@
 from __future__ import absolute_import, print_function, unicode_literals
-from curdling.index import Index, PackageNotFound
+from curdling.index import Index, ShardedIndex, PackageNotFound
+from mock import patch
 from . import FIXTURE
 
+import io
+import os
+import shutil
+import hashlib
+import threading
+
 
 def test_index_from_file():
     "It should be possible to index packages from files"
@@ -70,3 +77,379 @@ def test_index_scan_when_there_is_no_dir():
 
     # When I scan the directory, I see it does not fail
     index.scan()
+
+
+def test_index_scan_saves_manifest():
+    "Index.scan() should save a manifest and use it on the next scan"
+
+    # Given an index that points to a directory with a package
+    index = Index(FIXTURE('index'))
+    index.from_file(FIXTURE('storage1/gherkin-0.1.0.tar.gz'))
+
+    # When I scan the directory for the first time
+    Index(FIXTURE('index')).scan()
+
+    # Then I see that the manifest was written describing the package
+    manifest = index.load_manifest()
+    manifest['files']['gherkin-0.1.0.tar.gz']['name'].should.equal('gherkin')
+    manifest['files']['gherkin-0.1.0.tar.gz']['version'].should.equal('0.1.0')
+    manifest['files']['gherkin-0.1.0.tar.gz']['format'].should.equal('gz')
+
+    # And when I scan it again, the directory is not listed anymore
+    other = Index(FIXTURE('index'))
+    with patch('curdling.index.os.listdir') as listdir:
+        other.scan()
+        listdir.called.should.be.false
+
+    # And the package is still there
+    other.get('gherkin==0.1.0').should.equal(
+        FIXTURE('index/gherkin-0.1.0.tar.gz'),
+    )
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_scan_reconciles_manifest():
+    "Index.scan() should notice files added and removed after the manifest was saved"
+
+    # Given an index with a manifest already saved
+    index = Index(FIXTURE('index'))
+    index.from_file(FIXTURE('storage1/gherkin-0.1.0.tar.gz'))
+    Index(FIXTURE('index')).scan()
+
+    # When another package is added and the first one is removed
+    os.unlink(FIXTURE('index/gherkin-0.1.0.tar.gz'))
+    shutil.copy(FIXTURE('storage2/gherkin-0.1.0-py27-none-any.whl'),
+                FIXTURE('index/gherkin-0.1.0-py27-none-any.whl'))
+    os.utime(FIXTURE('index'), (0, 0))
+
+    # Then I see the next scan finds only the new file
+    other = Index(FIXTURE('index'))
+    other.scan()
+    dict(other.storage).should.equal({
+        'gherkin': {'0.1.0': ['gherkin-0.1.0-py27-none-any.whl']},
+    })
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_scan_with_corrupt_manifest():
+    "Index.scan() should scan the whole directory if the manifest is broken"
+
+    # Given an index with a broken manifest
+    index = Index(FIXTURE('index'))
+    index.from_file(FIXTURE('storage1/gherkin-0.1.0.tar.gz'))
+    with open(index.ensure_path(index.manifest_path()), 'w') as fobj:
+        fobj.write('{"this is not')
+
+    # When I scan the directory
+    index.scan()
+
+    # Then I see the package was found anyway
+    index.get('gherkin==0.1.0').should.equal(
+        FIXTURE('index/gherkin-0.1.0.tar.gz'),
+    )
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_digest_is_calculated_once():
+    "Index.digest() should reuse digests calculated when the file was written"
+
+    # Given that I have an index with a package
+    index = Index(FIXTURE('index'))
+    index.from_file(FIXTURE('storage1/gherkin-0.1.0.tar.gz'))
+    with open(FIXTURE('storage1/gherkin-0.1.0.tar.gz'), 'rb') as fobj:
+        expected = hashlib.sha256(fobj.read()).hexdigest()
+
+    # When I list the releases of the package
+    with patch('curdling.index.filehash') as filehash:
+        releases = index.package_releases('gherkin')
+
+        # Then I see the file was not read again
+        filehash.called.should.be.false
+    releases[0]['urls'][0]['sha256'].should.equal(expected)
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_digest_survives_scans_and_follows_changes():
+    "Index.digest() should keep digests across scans and notice changed files"
+
+    # Given that I have an index with a package
+    index = Index(FIXTURE('index'))
+    index.from_file(FIXTURE('storage1/gherkin-0.1.0.tar.gz'))
+    digest = index.digest('gherkin-0.1.0.tar.gz')
+
+    # When another index scans the same directory
+    other = Index(FIXTURE('index'))
+    other.scan()
+
+    # Then I see it knows the digest without reading the file
+    with patch('curdling.index.filehash') as filehash:
+        other.digest('gherkin-0.1.0.tar.gz').should.equal(digest)
+        filehash.called.should.be.false
+
+    # And when the file changes, the digest is calculated again
+    with open(FIXTURE('index/gherkin-0.1.0.tar.gz'), 'ab') as fobj:
+        fobj.write(b'changed')
+    other.digest('gherkin-0.1.0.tar.gz').should_not.equal(digest)
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_sharded_index():
+    "ShardedIndex should store files in subdirectories and dedupe their content"
+
+    # Given that I have a sharded index
+    index = ShardedIndex(FIXTURE('index'))
+
+    # When I add the same package under two different names
+    first = index.from_file(FIXTURE('storage1/gherkin-0.1.0.tar.gz'))
+    data = open(FIXTURE('storage1/gherkin-0.1.0.tar.gz'), 'rb').read()
+    second = index.from_data('gherkin-0.1.1.tar.gz', data)
+
+    # Then I see the content was stored only once
+    digest = index.digest(first)
+    objects = []
+    for path, _, files in os.walk(FIXTURE('index', 'objects')):
+        objects.extend(files)
+    objects.should.equal([digest])
+    os.path.realpath(first).should.equal(os.path.realpath(second))
+
+    # And that lookups work just like in the flat index
+    index.get('gherkin==0.1.0').should.equal(first)
+    index.open('gherkin-0.1.1.tar.gz', 'rb').read().should.equal(data)
+
+    # And that another index finds everything when scanning the folder
+    other = ShardedIndex(FIXTURE('index'))
+    other.scan()
+    sorted(other.storage['gherkin'].keys()).should.equal(['0.1.0', '0.1.1'])
+    other.files['gherkin-0.1.1.tar.gz']['sha256'].should.equal(digest)
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_from_stream():
+    "It should be possible to index data from file-like objects and iterators"
+
+    # Given the following index
+    index = Index(FIXTURE('index'))
+    data = open(FIXTURE('storage1/gherkin-0.1.0.tar.gz'), 'rb').read()
+
+    # When I index a file-like object and a list of chunks
+    index.from_stream('gherkin-0.1.0.tar.gz', io.BytesIO(data))
+    index.from_stream('gherkin-0.1.1.tar.gz', [data[:10], data[10:]])
+
+    # Then I see both packages with the right content
+    index.open('gherkin-0.1.0.tar.gz', 'rb').read().should.equal(data)
+    index.open('gherkin-0.1.1.tar.gz', 'rb').read().should.equal(data)
+    index.digest('gherkin-0.1.1.tar.gz').should.equal(
+        hashlib.sha256(data).hexdigest())
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_from_stream_failure_keeps_previous_file():
+    "Index.from_stream() should not leave half written files behind"
+
+    # Given that I have an index with a package
+    index = Index(FIXTURE('index'))
+    data = open(FIXTURE('storage1/gherkin-0.1.0.tar.gz'), 'rb').read()
+    index.from_data('gherkin-0.1.0.tar.gz', data)
+
+    # When the stream of a new upload of the same file breaks in the middle
+    def broken():
+        yield b'garbage'
+        raise IOError('connection lost')
+    index.from_stream.when.called_with(
+        'gherkin-0.1.0.tar.gz', broken()).should.throw(IOError)
+
+    # Then I see the previous file is still there, and no temporary files
+    # were left behind
+    index.open('gherkin-0.1.0.tar.gz', 'rb').read().should.equal(data)
+    sorted(os.listdir(FIXTURE('index'))).should.equal(
+        ['.curdling', 'gherkin-0.1.0.tar.gz'])
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_from_stream_skips_identical_files():
+    "Index.from_stream() should not rewrite files that didn't change"
+
+    # Given that I have an index with a package
+    index = Index(FIXTURE('index'))
+    data = open(FIXTURE('storage1/gherkin-0.1.0.tar.gz'), 'rb').read()
+    path = index.from_data('gherkin-0.1.0.tar.gz', data)
+    inode = os.stat(path).st_ino
+    journal = open(index.journal_path()).read()
+
+    # When the same content is uploaded again
+    index.from_stream('gherkin-0.1.0.tar.gz', io.BytesIO(data))
+
+    # Then I see the file was not replaced and nothing was journaled
+    os.stat(path).st_ino.should.equal(inode)
+    open(index.journal_path()).read().should.equal(journal)
+    sorted(os.listdir(FIXTURE('index'))).should.equal(
+        ['.curdling', 'gherkin-0.1.0.tar.gz'])
+
+    # And when a different content is uploaded with the same name
+    index.from_data('gherkin-0.1.0.tar.gz', b'new content')
+
+    # Then I see the new content replaced the old one
+    index.open('gherkin-0.1.0.tar.gz', 'rb').read().should.equal(
+        b'new content')
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_from_stream_indexes_files_already_on_disk():
+    "Index.from_stream() should index files that were on disk but not indexed"
+
+    # Given that I have an index and a package copied to its folder after it
+    # was scanned
+    os.makedirs(FIXTURE('index'))
+    index = Index(FIXTURE('index'))
+    index.scan()
+    shutil.copy(FIXTURE('storage1/gherkin-0.1.0.tar.gz'),
+                FIXTURE('index/gherkin-0.1.0.tar.gz'))
+    data = open(FIXTURE('storage1/gherkin-0.1.0.tar.gz'), 'rb').read()
+
+    # When the same content is uploaded under the same name
+    index.from_data('gherkin-0.1.0.tar.gz', data)
+
+    # Then I see the package can be found
+    index.get('gherkin').should.equal(FIXTURE('index/gherkin-0.1.0.tar.gz'))
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_digest_of_files_not_indexed():
+    "Index.digest() should not register files that are not indexed"
+
+    # Given that I have an index and a package it doesn't know about
+    os.makedirs(FIXTURE('index'))
+    index = Index(FIXTURE('index'))
+    index.scan()
+    shutil.copy(FIXTURE('storage1/gherkin-0.1.0.tar.gz'),
+                FIXTURE('index/gherkin-0.1.0.tar.gz'))
+
+    # When I ask for its digest
+    with open(FIXTURE('storage1/gherkin-0.1.0.tar.gz'), 'rb') as fobj:
+        index.digest('gherkin-0.1.0.tar.gz').should.equal(
+            hashlib.sha256(fobj.read()).hexdigest())
+
+    # Then I see the file is still unknown, so a refresh picks it up
+    index.files.should.equal({})
+    os.utime(FIXTURE('index'), (0, 0))
+    index.refresh().should.be.true
+    index.get('gherkin').should.equal(FIXTURE('index/gherkin-0.1.0.tar.gz'))
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_refresh():
+    "Index.refresh() should notice files added and removed by other processes"
+
+    # Given that I have a scanned index
+    index = Index(FIXTURE('index'))
+    index.from_file(FIXTURE('storage1/gherkin-0.1.0.tar.gz'))
+    index.scan()
+    index.get('gherkin').should.equal(FIXTURE('index/gherkin-0.1.0.tar.gz'))
+
+    # When another process replaces the tarball with a wheel
+    os.unlink(FIXTURE('index/gherkin-0.1.0.tar.gz'))
+    shutil.copy(FIXTURE('storage2/gherkin-0.1.0-py27-none-any.whl'),
+                FIXTURE('index/gherkin-0.1.0-py27-none-any.whl'))
+    os.utime(FIXTURE('index'), (0, 0))
+
+    # Then I see the index follows the change after a refresh
+    index.refresh().should.be.true
+    index.get('gherkin').should.equal(
+        FIXTURE('index/gherkin-0.1.0-py27-none-any.whl'))
+    index.get.when.called_with('gherkin;~whl').should.throw(PackageNotFound)
+
+    # And that nothing happens if nothing changed
+    index.refresh().should.be.false
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_refresh_replaced_files():
+    "Index.refresh() should notice files replaced by other processes"
+
+    # Given that I have two indexes sharing a directory, like two workers
+    # of the server, and a listener connected to the second one
+    index = Index(FIXTURE('index'))
+    index.from_data('gherkin-0.1.0.tar.gz', b'one')
+    other = Index(FIXTURE('index'))
+    other.scan()
+    other.digest('gherkin-0.1.0.tar.gz').should.equal(
+        hashlib.sha256(b'one').hexdigest())
+    updates = []
+    other.connect('updated', lambda requester, package: updates.append(package))
+
+    # When the first one receives another content for the same file
+    index.from_data('gherkin-0.1.0.tar.gz', b'other')
+    os.utime(FIXTURE('index'), (0, 0))
+
+    # Then I see the second one forgets the old digest after a refresh
+    other.refresh().should.be.true
+    other.digest('gherkin-0.1.0.tar.gz').should.equal(
+        hashlib.sha256(b'other').hexdigest())
+    updates.should.equal(['gherkin'])
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_index_concurrent_reads_and_writes():
+    "Index should answer lookups while other threads are adding packages"
+
+    # Given an index and a few threads adding versions of many packages
+    index = Index('')
+    errors = []
+
+    def writer(start):
+        for version in range(start, 50, 2):
+            for package in range(20):
+                index.index('pkg{0}-0.{1}.tar.gz'.format(package, version))
+
+    def reader():
+        try:
+            for _ in range(50):
+                for package in range(20):
+                    try:
+                        index.get('pkg{0} (>= 0.1)'.format(package))
+                    except PackageNotFound:
+                        pass
+                for package in index.list_packages():
+                    for version, files in index.storage[package].items():
+                        assert len(files) == 1, files
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(2)]
+    threads += [threading.Thread(target=reader) for _ in range(4)]
+
+    # When they all run at the same time
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    # Then I see no reader failed and the last versions are found
+    errors.should.be.empty
+    for package in range(20):
+        index.get('pkg{0}'.format(package)).should.equal(
+            'pkg{0}-0.49.tar.gz'.format(package))
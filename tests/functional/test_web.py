@@ -0,0 +1,571 @@
+from __future__ import absolute_import, print_function, unicode_literals
+from curdling.index import Index
+from curdling.web import App, HtPasswd, AUTH_CACHE_TTL, MIN_COMPRESS_SIZE
+from curdling.web import satisfiable_ranges
+from mock import patch
+from . import FIXTURE
+
+import io
+import os
+import json
+import re
+import zlib
+import crypt
+import shutil
+
+# The tests patch `crypt.crypt()` to count calls, the user database is
+# written with the original function
+CRYPT = crypt.crypt
+
+
+def build_app():
+    index = Index(FIXTURE('index'))
+    data = open(FIXTURE('storage1/gherkin-0.1.0.tar.gz'), 'rb').read()
+    index.from_data('gherkin-0.1.0.tar.gz', data)
+    return App(index), index, data
+
+
+def build_htpasswd(**users):
+    if not os.path.isdir(FIXTURE('index')):
+        os.makedirs(FIXTURE('index'))
+    with open(FIXTURE('index', 'htpasswd'), 'w') as fobj:
+        for username, password in sorted(users.items()):
+            fobj.write('{0}:{1}\n'.format(
+                username, CRYPT(password, 'ab')))
+    return HtPasswd(FIXTURE('index', 'htpasswd'))
+
+
+def test_satisfiable_ranges():
+    "satisfiable_ranges() should clip ranges to the file and drop the others"
+
+    # Given the ranges of a `Range` header, with a suffix range, an open one
+    # and one past the end of a file with 50 bytes
+    ranges = [(0, 10), (-5, None), (100, None), (40, None), (45, 1000)]
+
+    # When I convert them to offsets
+    result = satisfiable_ranges(ranges, 50)
+
+    # Then I see the ones that start after the end were dropped
+    result.should.equal([(0, 10), (45, 50), (40, 50), (45, 50)])
+
+    # And that a suffix bigger than the file means the whole file
+    satisfiable_ranges([(-100, None)], 50).should.equal([(0, 50)])
+
+
+def test_web_download_single_range():
+    "Downloads should honor a single `Range`"
+
+    # Given that I have a server with a package
+    app, index, data = build_app()
+    client = app.test_client()
+
+    # When I ask for a piece of the package
+    response = client.get('/p/gherkin-0.1.0.tar.gz',
+                          headers={'Range': 'bytes=10-19'})
+
+    # Then I see only that piece was sent
+    response.status_code.should.equal(206)
+    response.data.should.equal(data[10:20])
+    response.headers['Content-Range'].should.equal(
+        'bytes 10-19/{0}'.format(len(data)))
+    int(response.headers['Content-Length']).should.equal(10)
+
+    # And that caches are told to check with us before reusing the file,
+    # since uploads can replace it
+    response.headers['Cache-Control'].should.equal('no-cache')
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_download_multiple_ranges():
+    "Downloads should send many ranges in a `multipart/byteranges` body"
+
+    # Given that I have a server with a package
+    app, index, data = build_app()
+    client = app.test_client()
+
+    # When I ask for two pieces of the package
+    response = client.get('/p/gherkin-0.1.0.tar.gz',
+                          headers={'Range': 'bytes=0-4,-5'})
+
+    # Then I see both pieces, each one in its own part
+    response.status_code.should.equal(206)
+    boundary = re.findall(
+        r'boundary=(\w+)', response.headers['Content-Type'])[0]
+    parts = response.data.split('--{0}'.format(boundary).encode('ascii'))
+    parts[1].should.contain('Content-Range: bytes 0-4/{0}'.format(
+        len(data)).encode('ascii'))
+    parts[1].endswith(b'\r\n\r\n' + data[:5] + b'\r\n').should.be.true
+    parts[2].should.contain('Content-Range: bytes {0}-{1}/{2}'.format(
+        len(data) - 5, len(data) - 1, len(data)).encode('ascii'))
+    parts[2].endswith(b'\r\n\r\n' + data[-5:] + b'\r\n').should.be.true
+    parts[3].should.equal(b'--\r\n')
+
+    # And that the `Content-Length` we promised is the size of the body
+    int(response.headers['Content-Length']).should.equal(len(response.data))
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_download_if_range():
+    "Downloads should ignore the `Range` when `If-Range` doesn't match"
+
+    # Given that I have a server with a package
+    app, index, data = build_app()
+    client = app.test_client()
+    etag = '"{0}"'.format(index.digest('gherkin-0.1.0.tar.gz'))
+
+    # When I ask for a piece of the package I have
+    response = client.get('/p/gherkin-0.1.0.tar.gz', headers={
+        'Range': 'bytes=10-19', 'If-Range': etag})
+
+    # Then I see the piece was sent
+    response.status_code.should.equal(206)
+    response.data.should.equal(data[10:20])
+
+    # And when I have a piece of another file
+    response = client.get('/p/gherkin-0.1.0.tar.gz', headers={
+        'Range': 'bytes=10-19', 'If-Range': '"another-file"'})
+
+    # Then I see the whole file was sent
+    response.status_code.should.equal(200)
+    response.data.should.equal(data)
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_download_unsatisfiable_range():
+    "Downloads should answer `416` for ranges past the end of the file"
+
+    # Given that I have a server with a package
+    app, index, data = build_app()
+    client = app.test_client()
+
+    # When I ask for a piece after the end of the package
+    response = client.get('/p/gherkin-0.1.0.tar.gz', headers={
+        'Range': 'bytes={0}-'.format(len(data) + 10)})
+
+    # Then I see there's nothing to send
+    response.status_code.should.equal(416)
+    response.headers['Content-Range'].should.equal(
+        'bytes */{0}'.format(len(data)))
+
+    # And I clean the mess
+    index.delete()
+
+
+@patch('curdling.web.crypt.crypt', side_effect=CRYPT)
+def test_htpasswd_remembers_successful_authentications(patched_crypt):
+    "HtPasswd.auth() should only check a valid password once"
+
+    # Given that I have a user database
+    db = build_htpasswd(lincoln='secret')
+
+    # When the same user authenticates twice
+    db.auth('lincoln', 'secret').should.be.true
+    db.auth('lincoln', 'secret').should.be.true
+
+    # Then I see the password was checked only once
+    patched_crypt.call_count.should.equal(1)
+
+    # And I clean the mess
+    shutil.rmtree(FIXTURE('index'))
+
+
+@patch('curdling.web.crypt.crypt', side_effect=CRYPT)
+def test_htpasswd_does_not_remember_failures(patched_crypt):
+    "HtPasswd.auth() should check wrong passwords every time"
+
+    # Given that I have a user database
+    db = build_htpasswd(lincoln='secret')
+
+    # When a user tries a wrong password twice
+    db.auth('lincoln', 'wrong').should.be.false
+    db.auth('lincoln', 'wrong').should.be.false
+
+    # Then I see the password was checked both times
+    patched_crypt.call_count.should.equal(2)
+
+    # And that a valid password still works afterwards
+    db.auth('lincoln', 'secret').should.be.true
+
+    # And I clean the mess
+    shutil.rmtree(FIXTURE('index'))
+
+
+@patch('curdling.web.time.time')
+@patch('curdling.web.crypt.crypt', side_effect=CRYPT)
+def test_htpasswd_authentications_expire(patched_crypt, patched_time):
+    "HtPasswd.auth() should check the password again after AUTH_CACHE_TTL"
+
+    # Given that I have a user database and a user that authenticated
+    db = build_htpasswd(lincoln='secret')
+    patched_time.return_value = 1000
+    db.auth('lincoln', 'secret').should.be.true
+
+    # When the user authenticates again before and after the TTL
+    patched_time.return_value = 1000 + AUTH_CACHE_TTL - 1
+    db.auth('lincoln', 'secret').should.be.true
+    patched_time.return_value = 1000 + AUTH_CACHE_TTL + 1
+    db.auth('lincoln', 'secret').should.be.true
+
+    # Then I see the password was checked again only after it expired
+    patched_crypt.call_count.should.equal(2)
+
+    # And I clean the mess
+    shutil.rmtree(FIXTURE('index'))
+
+
+@patch('curdling.web.AUTH_CACHE_SIZE', 1)
+@patch('curdling.web.crypt.crypt', side_effect=CRYPT)
+def test_htpasswd_remembers_a_limited_number_of_users(patched_crypt):
+    "HtPasswd.auth() should forget the least recently used authentications"
+
+    # Given that I have a user database with two users
+    db = build_htpasswd(lincoln='secret', gabriel='other')
+
+    # When they take turns to authenticate with a cache for one of them
+    db.auth('lincoln', 'secret').should.be.true
+    db.auth('gabriel', 'other').should.be.true
+    db.auth('lincoln', 'secret').should.be.true
+
+    # Then I see every authentication checked the password
+    patched_crypt.call_count.should.equal(3)
+    len(db.verdicts).should.equal(1)
+
+    # And I clean the mess
+    shutil.rmtree(FIXTURE('index'))
+
+
+def test_htpasswd_changes_revoke_remembered_authentications():
+    "HtPasswd.auth() should forget everything when the file changes"
+
+    # Given that I have a user database and a user that authenticated
+    db = build_htpasswd(lincoln='secret')
+    db.auth('lincoln', 'secret').should.be.true
+
+    # When the password of the user is changed in the file
+    build_htpasswd(lincoln='changed')
+    os.utime(FIXTURE('index', 'htpasswd'), (0, 0))
+
+    # Then I see the old password doesn't work anymore, but the new one does
+    db.auth('lincoln', 'secret').should.be.false
+    db.auth('lincoln', 'changed').should.be.true
+
+    # And I clean the mess
+    shutil.rmtree(FIXTURE('index'))
+
+
+def test_web_index_pages_have_their_own_cache():
+    "The pages of the landing page should not evict the documents of the API"
+
+    # Given that I have a server with a package, that already answered a
+    # request to the API and one to the landing page
+    app, index, data = build_app()
+    client = app.test_client()
+    client.get('/api/gherkin').status_code.should.equal(200)
+    client.get('/').status_code.should.equal(200)
+    documents = app.documents.stats()['size']
+
+    # When clients ask for lots of different filters
+    for i in range(50):
+        client.get('/?q=filter{0}'.format(i)).status_code.should.equal(200)
+
+    # Then I see the pages were cached apart from the other documents
+    app.documents.stats()['size'].should.equal(documents)
+    app.pages.stats()['size'].should.equal(51)
+
+    # And that filters that only differ in case share the same page
+    client.get('/?q=GHERKIN').data.should.contain(b'gherkin')
+    client.get('/?q=gherkin')
+    app.pages.stats()['size'].should.equal(52)
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_api_package_is_cached_until_the_package_changes():
+    "/api/<package> should be served from the cache until the index changes"
+
+    # Given that I have a server with a package
+    app, index, data = build_app()
+    client = app.test_client()
+
+    # When I ask for the releases of the package
+    response = client.get('/api/gherkin')
+
+    # Then I see the document comes with an ETag
+    response.status_code.should.equal(200)
+    etag = response.headers['ETag']
+    json.loads(response.data.decode('utf-8'))[0]['version'].should.equal(
+        '0.1.0')
+
+    # And that asking again with the ETag tells me nothing changed, without
+    # rendering the document again
+    response = client.get('/api/gherkin', headers={'If-None-Match': etag})
+    response.status_code.should.equal(304)
+    app.documents.stats()['hits'].should.equal(1)
+
+    # And when a new release of the package is added to the index
+    index.from_data('gherkin-0.2.0.tar.gz', data)
+
+    # Then I see the document is rendered again, with the new release
+    response = client.get('/api/gherkin', headers={'If-None-Match': etag})
+    response.status_code.should.equal(200)
+    response.headers['ETag'].should_not.equal(etag)
+    sorted(r['version'] for r in json.loads(
+        response.data.decode('utf-8'))).should.equal(['0.1.0', '0.2.0'])
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_simple_index():
+    "/simple/ should link to the PEP 503 name of every project"
+
+    # Given that I have a server with packages whose names aren't normalized
+    app, index, data = build_app()
+    index.from_data('Python_Gherkin-0.1.0.tar.gz', data)
+    client = app.test_client()
+
+    # When I ask for the simple index
+    response = client.get('/simple/')
+
+    # Then I see a link to each project
+    response.status_code.should.equal(200)
+    response.data.should.contain(b'<a href="/simple/gherkin/">gherkin</a>')
+    response.data.should.contain(
+        b'<a href="/simple/python-gherkin/">python-gherkin</a>')
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_simple_project():
+    "/simple/<project>/ should link to the files with their digests"
+
+    # Given that I have a server with a package
+    app, index, data = build_app()
+    client = app.test_client()
+    digest = index.digest('gherkin-0.1.0.tar.gz')
+
+    # When I ask for the page of the project
+    response = client.get('/simple/gherkin/')
+
+    # Then I see the link to the file carries its digest
+    response.status_code.should.equal(200)
+    response.data.should.contain(
+        '<a href="/p/gherkin-0.1.0.tar.gz#sha256={0}">'.format(
+            digest).encode('ascii'))
+
+    # And that projects we don't have are not found
+    client.get('/simple/cucumber/').status_code.should.equal(404)
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_simple_project_redirects_to_normalized_names():
+    "/simple/<project>/ should redirect to the PEP 503 name of the project"
+
+    # Given that I have a server with a package
+    app, index, data = build_app()
+    index.from_data('Python_Gherkin-0.1.0.tar.gz', data)
+    client = app.test_client()
+
+    # When I ask for the project with a name that's not normalized
+    response = client.get('/simple/Python_Gherkin/')
+
+    # Then I'm sent to the normalized name, which has the file
+    response.status_code.should.equal(301)
+    response.headers['Location'].should.match(r'/simple/python-gherkin/$')
+    client.get('/simple/python-gherkin/').data.should.contain(
+        b'Python_Gherkin-0.1.0.tar.gz')
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_simple_project_is_updated_after_uploads():
+    "/simple/<project>/ should list files uploaded after it was cached"
+
+    # Given that I have a server with a package that was already listed
+    app, index, data = build_app()
+    client = app.test_client()
+    client.get('/simple/gherkin/').data.should_not.contain(
+        b'gherkin-0.2.0.tar.gz')
+    client.get('/simple/').data.should_not.contain(b'cucumber')
+
+    # When new files are uploaded
+    client.put('/p/gherkin-0.2.0.tar.gz', data={
+        'gherkin-0.2.0.tar.gz': (io.BytesIO(data), 'gherkin-0.2.0.tar.gz')})
+    client.put('/p/cucumber-0.1.0.tar.gz', data={
+        'cucumber-0.1.0.tar.gz': (io.BytesIO(data), 'cucumber-0.1.0.tar.gz')})
+
+    # Then I see them listed in the simple index
+    client.get('/simple/gherkin/').data.should.contain(
+        b'gherkin-0.2.0.tar.gz')
+    client.get('/simple/').data.should.contain(b'cucumber')
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_api_batch():
+    "POST /api/ should answer with the releases of many packages"
+
+    # Given that I have a server with two packages
+    app, index, data = build_app()
+    index.from_data('cucumber-0.1.0.tar.gz', data)
+    client = app.test_client()
+
+    # When I ask for packages using names and requirements, including one
+    # the server doesn't have
+    response = client.post('/api/', data=json.dumps({'packages': [
+        'gherkin>=0.1.0', 'Cucumber (== 0.1.0)', 'forbiddenfruit']}))
+
+    # Then I see the releases of the packages the server has, just like
+    # `/api/<package>` would answer
+    response.status_code.should.equal(200)
+    projects = json.loads(response.data.decode('utf-8'))
+    sorted(projects).should.equal(['cucumber', 'gherkin'])
+    projects['gherkin'].should.equal(json.loads(
+        client.get('/api/gherkin').data.decode('utf-8')))
+
+    # And I clean the mess
+    index.delete()
+
+
+@patch('curdling.web.MAX_BATCH_SIZE', 2)
+def test_web_api_batch_errors():
+    "POST /api/ should refuse malformed and too big requests"
+
+    # Given that I have a server with a package
+    app, index, data = build_app()
+    client = app.test_client()
+
+    # When I send something that's not JSON
+    response = client.post('/api/', data='gherkin')
+
+    # Then I see the request is refused
+    response.status_code.should.equal(400)
+
+    # And when the list of packages is missing
+    client.post('/api/', data='{}').status_code.should.equal(400)
+
+    # And when I ask for more packages than allowed
+    response = client.post('/api/', data=json.dumps({
+        'packages': ['gherkin', 'cucumber', 'forbiddenfruit']}))
+
+    # Then I see the request is too big
+    response.status_code.should.equal(413)
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_metrics():
+    "/metrics should count the requests handled by the server"
+
+    # Given that I have a server with a package
+    app, index, data = build_app()
+    client = app.test_client()
+
+    # When clients download the package and send some weird requests
+    client.get('/p/gherkin-0.1.0.tar.gz').status_code.should.equal(200)
+    client.get('/p/gherkin-0.1.0.tar.gz').status_code.should.equal(200)
+    client.open('/p/gherkin-0.1.0.tar.gz', method='BREW')
+    client.get('/api/cucumber').status_code.should.equal(404)
+
+    # Then I see them in the metrics, with the worker that handled them
+    response = client.get('/metrics')
+    response.status_code.should.equal(200)
+    response.headers['Content-Type'].should.contain('text/plain')
+    worker = 'worker="{0}"'.format(os.getpid())
+    lines = response.data.decode('utf-8').splitlines()
+    lines.should.contain(
+        'curdling_http_requests_total{method="GET",route="download",'
+        'status="200",' + worker + '} 2')
+    lines.should.contain(
+        'curdling_http_requests_total{method="GET",route="api.package",'
+        'status="404",' + worker + '} 1')
+    lines.should.contain(
+        'curdling_http_response_bytes_total{route="download",' + worker +
+        '} ' + str(len(data) * 2))
+
+    # And that the made up method didn't get a series of its own
+    [l for l in lines if 'BREW' in l].should.be.empty
+    [l for l in lines if 'method="other"' in l].should.have.length_of(1)
+
+    # And that the request to `/metrics` is still in flight
+    lines.should.contain(
+        'curdling_http_requests_in_flight{' + worker + '} 1')
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_documents_are_compressed():
+    "Documents should be compressed for the clients that accept it"
+
+    # Given that I have a server with enough packages for a big document
+    app, index, data = build_app()
+    for i in range(100):
+        index.from_data('package{0}-0.1.0.tar.gz'.format(i), b'data')
+    client = app.test_client()
+    plain = client.get('/api/')
+    len(plain.data).should.be.greater_than(MIN_COMPRESS_SIZE)
+    plain.headers.get('Content-Encoding').should.be.none
+    plain.headers['Vary'].should.equal('Accept-Encoding')
+
+    # When I ask for it accepting gzip
+    response = client.get('/api/', headers={'Accept-Encoding': 'gzip'})
+
+    # Then I see a gzip stream of the same document, with an ETag of its own
+    response.headers['Content-Encoding'].should.equal('gzip')
+    response.headers['Vary'].should.equal('Accept-Encoding')
+    zlib.decompress(response.data, 16 + zlib.MAX_WBITS).should.equal(
+        plain.data)
+    response.headers['ETag'].should.equal(
+        plain.headers['ETag'][:-1] + '-gzip"')
+
+    # And that the compressed version is also answered with a 304
+    client.get('/api/', headers={
+        'Accept-Encoding': 'gzip',
+        'If-None-Match': response.headers['ETag'],
+    }).status_code.should.equal(304)
+
+    # And when I ask for it accepting only deflate
+    response = client.get('/api/', headers={'Accept-Encoding': 'deflate'})
+
+    # Then I see a zlib stream, as HTTP's deflate means
+    response.headers['Content-Encoding'].should.equal('deflate')
+    zlib.decompress(response.data).should.equal(plain.data)
+    response.headers['ETag'].should.equal(
+        plain.headers['ETag'][:-1] + '-deflate"')
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_small_documents_are_not_compressed():
+    "Documents smaller than MIN_COMPRESS_SIZE should be sent as they are"
+
+    # Given that I have a server with a package
+    app, index, data = build_app()
+    client = app.test_client()
+
+    # When I ask for a small document accepting gzip
+    response = client.get('/api/gherkin', headers={'Accept-Encoding': 'gzip'})
+
+    # Then I see it was not compressed
+    len(response.data).should.be.lower_than(MIN_COMPRESS_SIZE)
+    response.headers.get('Content-Encoding').should.be.none
+    json.loads(response.data.decode('utf-8'))[0]['name'].should.equal(
+        'gherkin')
+
+    # And I clean the mess
+    index.delete()
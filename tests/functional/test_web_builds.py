@@ -0,0 +1,231 @@
+from __future__ import absolute_import, print_function, unicode_literals
+from curdling.index import Index
+from curdling.web import App
+from curdling.web.builds import Builds
+from mock import patch
+from . import FIXTURE
+
+import os
+import json
+
+
+def build_index():
+    index = Index(FIXTURE('index'))
+    index.from_file(FIXTURE('storage1/gherkin-0.1.0.tar.gz'))
+    return index
+
+
+def queued(builds):
+    # Requirements waiting for the threads of the `Curdler`, that are never
+    # started in these tests
+    return [data['requirement'] for _, data in list(builds.curdler._queue.queue)]
+
+
+def test_builds_queue():
+    "Builds.queue() should build each source package only once"
+
+    # Given that I have an index with a source package and a wheel
+    index = build_index()
+    index.from_file(FIXTURE('storage2/gherkin-0.1.0-py27-none-any.whl'))
+    index.from_data('cucumber-0.1.0.tar.gz', b'cucumber')
+    builds = Builds(index, 1)
+
+    # When I ask for the build of the source package without a wheel
+    job = builds.queue('cucumber-0.1.0.tar.gz')
+
+    # Then I see the job was queued
+    job.should.equal({
+        'requirement': 'cucumber==0.1.0',
+        'tarball': 'cucumber-0.1.0.tar.gz',
+        'status': 'queued',
+        'wheel': None,
+        'error': None,
+    })
+    queued(builds).should.equal(['cucumber==0.1.0'])
+
+    # And that asking again doesn't queue it twice
+    builds.queue('cucumber-0.1.0.tar.gz').should.equal(job)
+    queued(builds).should.equal(['cucumber==0.1.0'])
+
+    # And that packages that already have a wheel are done right away
+    builds.queue('gherkin-0.1.0.tar.gz')['status'].should.equal('done')
+    queued(builds).should.equal(['cucumber==0.1.0'])
+
+    # And that wheels and files the index doesn't have can't be built
+    builds.queue('gherkin-0.1.0-py27-none-any.whl').should.be.none
+    builds.queue('forbiddenfruit-0.1.0.tar.gz').should.be.none
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_builds_are_shared_between_processes():
+    "Builds should see the jobs created by other workers"
+
+    # Given that I have two workers sharing the same index directory
+    index = build_index()
+    builds = Builds(index, 1)
+    other = Builds(Index(FIXTURE('index')), 1)
+    other.index.scan()
+
+    # When one of them queues a build
+    builds.queue('gherkin-0.1.0.tar.gz')
+
+    # Then I see the other one knows about it and doesn't build it again
+    other.get('gherkin-0.1.0.tar.gz')['status'].should.equal('queued')
+    other.queue('gherkin-0.1.0.tar.gz')['status'].should.equal('queued')
+    queued(other).should.be.empty
+
+    # And that it sees the progress of the job
+    builds.job_started('curdler', requirement='gherkin==0.1.0')
+    other.get('gherkin-0.1.0.tar.gz')['status'].should.equal('building')
+    builds.job_finished(
+        'curdler', requirement='gherkin==0.1.0',
+        wheel='/tmp/gherkin-0.1.0-py27-none-any.whl')
+    other.get('gherkin-0.1.0.tar.gz').should.equal({
+        'requirement': 'gherkin==0.1.0',
+        'tarball': 'gherkin-0.1.0.tar.gz',
+        'status': 'done',
+        'wheel': 'gherkin-0.1.0-py27-none-any.whl',
+        'error': None,
+    })
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_builds_save_claims_jobs():
+    "Builds.save() should let only one worker create the file of a job"
+
+    # Given that I have two workers sharing the same index directory
+    index = build_index()
+    builds = Builds(index, 1)
+    other = Builds(index, 1)
+
+    # When both try to create the file of the same job
+    job = {'status': 'queued', 'pid': os.getpid()}
+    first = builds.save('gherkin==0.1.0', dict(job, tarball='first'), False)
+    second = other.save('gherkin==0.1.0', dict(job, tarball='second'), False)
+
+    # Then I see only the first one made it
+    first.should.be.true
+    second.should.be.false
+    builds.load('gherkin==0.1.0')['tarball'].should.equal('first')
+
+    # And that no temporary files were left behind
+    os.listdir(builds.directory).should.equal(['gherkin==0.1.0.json'])
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_builds_of_dead_workers_fail():
+    "Builds should report jobs of workers that died as failed and retry them"
+
+    # Given that I have a job queued by a worker
+    index = build_index()
+    builds = Builds(index, 1)
+    builds.queue('gherkin-0.1.0.tar.gz')
+
+    # When the worker dies before finishing the job
+    with patch('curdling.web.builds.alive', return_value=False):
+        job = builds.get('gherkin-0.1.0.tar.gz')
+
+    # Then I see the job failed
+    job['status'].should.equal('failed')
+    job['error'].should.equal('the build was interrupted')
+
+    # And that asking for it again queues another build
+    with patch('curdling.web.builds.alive', return_value=False):
+        builds.queue('gherkin-0.1.0.tar.gz')['status'].should.equal('queued')
+    queued(builds).should.equal(['gherkin==0.1.0', 'gherkin==0.1.0'])
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_builds_failed_jobs_can_be_queued_again():
+    "Builds.queue() should try again the builds that failed"
+
+    # Given that I have a build that failed
+    index = build_index()
+    builds = Builds(index, 1)
+    builds.queue('gherkin-0.1.0.tar.gz')
+    builds.job_failed('curdler', requirement='gherkin==0.1.0',
+                      exception=Exception('no compiler'))
+    builds.get('gherkin-0.1.0.tar.gz')['error'].should.equal('no compiler')
+
+    # When I ask for the build again
+    job = builds.queue('gherkin-0.1.0.tar.gz')
+
+    # Then I see it's queued again, without the old error
+    job['status'].should.equal('queued')
+    job['error'].should.be.none
+    queued(builds).should.have.length_of(2)
+
+    # And I clean the mess
+    index.delete()
+
+
+@patch('curdling.web.builds.BUILD_HISTORY_SIZE', 2)
+def test_builds_prune():
+    "Builds should only remember the newest BUILD_HISTORY_SIZE jobs"
+
+    # Given that I have an index with three source packages
+    index = build_index()
+    for name in ('cucumber', 'pickle'):
+        index.from_data('{0}-0.1.0.tar.gz'.format(name), b'data')
+    builds = Builds(index, 1)
+
+    # When each one of them gets a job, the oldest one first
+    for mtime, name in enumerate(('gherkin', 'cucumber', 'pickle')):
+        builds.queue('{0}-0.1.0.tar.gz'.format(name))
+        path = builds.path('{0}==0.1.0'.format(name))
+        os.utime(path, (mtime, mtime))
+
+    # Then I see the oldest job was forgotten
+    builds.get('gherkin-0.1.0.tar.gz').should.be.none
+    builds.get('cucumber-0.1.0.tar.gz')['status'].should.equal('queued')
+    builds.get('pickle-0.1.0.tar.gz')['status'].should.equal('queued')
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_web_build():
+    "/b/<package> should queue builds and report their status"
+
+    # Given that I have a server that builds wheels
+    index = build_index()
+    builds = Builds(index, 1)
+    client = App(index, builds=builds).test_client()
+
+    # When I ask for the build of a source package
+    response = client.post('/b/gherkin-0.1.0.tar.gz')
+
+    # Then I see it was accepted
+    response.status_code.should.equal(202)
+    json.loads(response.data.decode('utf-8'))['status'].should.equal('queued')
+
+    # And that I can follow the job
+    response = client.get('/b/gherkin-0.1.0.tar.gz')
+    response.status_code.should.equal(200)
+    json.loads(response.data.decode('utf-8'))['status'].should.equal('queued')
+
+    # And when the job is done
+    builds.job_finished(
+        'curdler', requirement='gherkin==0.1.0',
+        wheel='/tmp/gherkin-0.1.0-py27-none-any.whl')
+
+    # Then I see asking for it again just tells me it's done
+    response = client.post('/b/gherkin-0.1.0.tar.gz')
+    response.status_code.should.equal(200)
+    json.loads(response.data.decode('utf-8'))['wheel'].should.equal(
+        'gherkin-0.1.0-py27-none-any.whl')
+
+    # And that packages the server doesn't have are not found
+    client.get('/b/cucumber-0.1.0.tar.gz').status_code.should.equal(404)
+    client.post('/b/cucumber-0.1.0.tar.gz').status_code.should.equal(404)
+
+    # And I clean the mess
+    index.delete()
@@ -0,0 +1,229 @@
+from __future__ import absolute_import, print_function, unicode_literals
+from curdling.index import Index
+from curdling.web import App
+from curdling.web.proxy import Proxy
+from mock import Mock, patch
+from . import FIXTURE
+
+import os
+import json
+import time
+import gevent
+import hashlib
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def upstream_page(*files):
+    # What `PyPiLocator.get_page()` returns for a project
+    return Mock(links=[
+        ('http://upstream/packages/{0}#sha256={1}'.format(file_name, digest), '')
+        for file_name, digest in files])
+
+
+def build_proxy(pages, contents):
+    """Proxy for an upstream index with `pages` and file `contents`
+
+    Both map what the upstream index would be asked for (project names and
+    file URLs) to what it would answer.
+    """
+    os.makedirs(FIXTURE('index'))
+    index = Index(FIXTURE('index'))
+    proxy = Proxy(index, 'http://upstream/', timeout=5)
+    proxy.pages = []
+    proxy.downloads = []
+
+    def get_page(url):
+        project = url.rstrip('/').split('/')[-1]
+        proxy.pages.append(project)
+        time.sleep(0.1)
+        return pages.get(project)
+
+    def download(url, locator_url):
+        proxy.downloads.append(url)
+        time.sleep(0.1)
+        file_name = url.split('/')[-1]
+        return 'tarball', index.from_data(file_name, contents[url])
+
+    proxy.downloader.download = download
+    patcher = patch('curdling.web.proxy.PyPiLocator')
+    patcher.start().return_value.get_page.side_effect = get_page
+    proxy.stop = lambda: (proxy.join(), patcher.stop())
+    return proxy.start(), index
+
+
+def test_proxy_hit():
+    "Proxy should list the packages of the upstream index and download them"
+
+    # Given a server proxying an index with a package we don't have
+    proxy, index = build_proxy({
+        'sure': upstream_page(
+            ('sure-1.2.1.tar.gz', sha256(b'1.2.1')),
+            ('sure-1.2.2.tar.gz', sha256(b'1.2.2'))),
+    }, {
+        'http://upstream/packages/sure-1.2.2.tar.gz': b'1.2.2',
+    })
+    client = App(index, proxy=proxy).test_client()
+
+    try:
+        # When I ask for the package
+        response = client.get('/api/sure')
+
+        # Then I see the files of the upstream index, with their digests
+        response.status_code.should.equal(200)
+        releases = json.loads(response.data.decode('utf-8'))
+        sorted((r['version'], r['urls']) for r in releases).should.equal([
+            ('1.2.1', [{'url': 'http://localhost/p/sure-1.2.1.tar.gz',
+                        'sha256': sha256(b'1.2.1')}]),
+            ('1.2.2', [{'url': 'http://localhost/p/sure-1.2.2.tar.gz',
+                        'sha256': sha256(b'1.2.2')}]),
+        ])
+        client.get('/simple/sure/').data.should.contain(
+            '/p/sure-1.2.1.tar.gz#sha256={0}'.format(
+                sha256(b'1.2.1')).encode('ascii'))
+
+        # And when I download one of them twice
+        client.get('/p/sure-1.2.2.tar.gz').data.should.equal(b'1.2.2')
+        client.get('/p/sure-1.2.2.tar.gz').data.should.equal(b'1.2.2')
+
+        # Then I see it was downloaded from the upstream index only once,
+        # and the listing was fetched only once too
+        proxy.downloads.should.equal(
+            ['http://upstream/packages/sure-1.2.2.tar.gz'])
+        proxy.pages.should.equal(['sure'])
+
+        # And that the other files of the upstream index are still listed
+        releases = json.loads(client.get('/api/sure').data.decode('utf-8'))
+        sorted(r['version'] for r in releases).should.equal(['1.2.1', '1.2.2'])
+    finally:
+        proxy.stop()
+
+        # And I clean the mess
+        index.delete()
+
+
+def test_proxy_miss():
+    "Proxy should not find what the upstream index doesn't have"
+
+    # Given a server proxying an index that doesn't have a package
+    proxy, index = build_proxy({}, {})
+    client = App(index, proxy=proxy).test_client()
+
+    try:
+        # When I ask for the package and one of its files
+        response = client.get('/api/forbiddenfruit')
+        download = client.get('/p/forbiddenfruit-0.1.0.tar.gz')
+
+        # Then I see none of them were found, and that the upstream index
+        # was asked only once
+        response.status_code.should.equal(404)
+        download.status_code.should.equal(404)
+        proxy.pages.should.equal(['forbiddenfruit'])
+        proxy.downloads.should.be.empty
+    finally:
+        proxy.stop()
+
+        # And I clean the mess
+        index.delete()
+
+
+def test_proxy_does_not_shadow_local_packages():
+    "Proxy should never add files of the upstream index to our packages"
+
+    # Given a server with a private package proxying an index that has a
+    # package with the same name and a bigger version
+    proxy, index = build_proxy({
+        'sure': upstream_page(('sure-1.2.2.tar.gz', sha256(b'1.2.2'))),
+    }, {
+        'http://upstream/packages/sure-1.2.2.tar.gz': b'1.2.2',
+    })
+    index.from_data('sure-0.0.1.tar.gz', b'private')
+    client = App(index, proxy=proxy).test_client()
+
+    try:
+        # When I ask for the package, with a name that's not normalized too
+        releases = json.loads(client.get('/api/sure').data.decode('utf-8'))
+        client.get('/api/Sure').status_code.should.equal(404)
+        page = client.get('/simple/sure/').data
+
+        # Then I see only our files
+        [r['version'] for r in releases].should.equal(['0.0.1'])
+        page.should_not.contain(b'sure-1.2.2')
+
+        # And that the files of the upstream index can't be downloaded
+        client.get('/p/sure-1.2.2.tar.gz').status_code.should.equal(404)
+
+        # And that the upstream index was never asked about it
+        proxy.pages.should.be.empty
+        proxy.downloads.should.be.empty
+    finally:
+        proxy.stop()
+
+        # And I clean the mess
+        index.delete()
+
+
+def test_proxy_removes_files_with_wrong_digests():
+    "Proxy should throw away downloads that don't match the listed digest"
+
+    # Given a server proxying an index that sends something else than what
+    # its listing promises
+    proxy, index = build_proxy({
+        'sure': upstream_page(('sure-1.2.2.tar.gz', sha256(b'1.2.2'))),
+    }, {
+        'http://upstream/packages/sure-1.2.2.tar.gz': b'evil',
+    })
+    client = App(index, proxy=proxy).test_client()
+
+    try:
+        # When I download the file
+        response = client.get('/p/sure-1.2.2.tar.gz')
+
+        # Then I see it was not found
+        response.status_code.should.equal(404)
+
+        # And that the file is not in the index
+        index.files.should_not.contain('sure-1.2.2.tar.gz')
+        os.path.exists(index.path('sure-1.2.2.tar.gz')).should.be.false
+    finally:
+        proxy.stop()
+
+        # And I clean the mess
+        index.delete()
+
+
+def test_proxy_coalesces_requests():
+    "Proxy should go upstream once for many concurrent requests"
+
+    # Given a server proxying an index with a package
+    proxy, index = build_proxy({
+        'sure': upstream_page(('sure-1.2.2.tar.gz', sha256(b'1.2.2'))),
+    }, {
+        'http://upstream/packages/sure-1.2.2.tar.gz': b'1.2.2',
+    })
+
+    try:
+        # When many clients ask for the same file at the same time
+        greenlets = [gevent.spawn(proxy.download, 'sure-1.2.2.tar.gz')
+                     for _ in range(5)]
+        gevent.joinall(greenlets)
+
+        # Then I see all of them got the file
+        [g.value for g in greenlets].should.equal([True] * 5)
+
+        # And that the listing and the file were asked only once
+        proxy.pages.should.equal(['sure'])
+        proxy.downloads.should.equal(
+            ['http://upstream/packages/sure-1.2.2.tar.gz'])
+
+        # And that the file is remembered as one of the upstream index, even
+        # by another process
+        Proxy(index, 'http://upstream/').owns(
+            ['sure-1.2.2.tar.gz']).should.be.true
+    finally:
+        proxy.stop()
+
+        # And I clean the mess
+        index.delete()
@@ -0,0 +1,181 @@
+from __future__ import absolute_import, print_function, unicode_literals
+from curdling.index import Index
+from curdling.web.replication import Replicator
+from mock import Mock, patch
+from . import FIXTURE
+
+import hashlib
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def release(name, version, *files):
+    return {'name': name, 'version': version, 'urls': [
+        {'url': 'http://remote/p/' + file_name, 'sha256': digest}
+        for file_name, digest in files]}
+
+
+def build_replicator(index, contents):
+    """Replicator whose downloads are saved right away
+
+    `contents` maps the URLs of the remote server to the bytes the
+    downloads get.
+    """
+    replicator = Replicator(index, ['http://remote/'])
+    downloaded = []
+
+    def queue(requester, requirement, url, locator_url):
+        downloaded.append(url)
+        path = index.from_data(url.split('/')[-1], contents[url])
+        replicator.download_finished('downloader', tarball=path)
+    replicator.downloader.queue = queue
+    return replicator, downloaded
+
+
+def test_replicate_downloads_what_we_do_not_have():
+    "Replicator.replicate() should only download files missing or different"
+
+    # Given that I have an index with two files
+    index = Index(FIXTURE('index'))
+    index.from_data('gherkin-0.1.0.tar.gz', b'gherkin')
+    index.from_data('gherkin-0.2.0.tar.gz', b'old')
+
+    # And a server with the same first file, another content for the second
+    # one and files we don't have, one without a known digest (like the
+    # ones a proxy didn't download yet)
+    replicator, downloaded = build_replicator(index, {
+        'http://remote/p/gherkin-0.2.0.tar.gz': b'new',
+        'http://remote/p/cucumber-0.1.0.tar.gz': b'cucumber',
+        'http://remote/p/pickle-0.1.0.tar.gz': b'pickle',
+    })
+    replicator.releases = Mock(return_value=[
+        release('gherkin', '0.1.0',
+                ('gherkin-0.1.0.tar.gz', sha256(b'gherkin'))),
+        release('gherkin', '0.2.0',
+                ('gherkin-0.2.0.tar.gz', sha256(b'new'))),
+        release('cucumber', '0.1.0',
+                ('cucumber-0.1.0.tar.gz', sha256(b'cucumber'))),
+        release('pickle', '0.1.0', ('pickle-0.1.0.tar.gz', None)),
+    ])
+
+    # When I replicate the server
+    replicator.replicate('http://remote/')
+
+    # Then I see only the files we didn't have or had with another content
+    # were downloaded
+    sorted(downloaded).should.equal([
+        'http://remote/p/cucumber-0.1.0.tar.gz',
+        'http://remote/p/gherkin-0.2.0.tar.gz',
+        'http://remote/p/pickle-0.1.0.tar.gz',
+    ])
+    index.digest('gherkin-0.2.0.tar.gz').should.equal(sha256(b'new'))
+    index.has_package('pickle').should.be.true
+
+    # And that a new pass finds nothing else to download
+    del downloaded[:]
+    replicator.replicate('http://remote/')
+    downloaded.should.be.empty
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_replicate_removes_files_with_wrong_digests():
+    "Replicator should remove downloads that don't match the server's digest"
+
+    # Given that I have a server whose file gets corrupted in the way
+    index = Index(FIXTURE('index'))
+    index.from_data('gherkin-0.1.0.tar.gz', b'gherkin')
+    replicator, downloaded = build_replicator(index, {
+        'http://remote/p/cucumber-0.1.0.tar.gz': b'corrupted',
+    })
+    replicator.releases = Mock(return_value=[
+        release('cucumber', '0.1.0',
+                ('cucumber-0.1.0.tar.gz', sha256(b'cucumber'))),
+    ])
+
+    # When I replicate the server
+    replicator.replicate('http://remote/')
+
+    # Then I see the file was downloaded but thrown away
+    downloaded.should.equal(['http://remote/p/cucumber-0.1.0.tar.gz'])
+    index.has_package('cucumber').should.be.false
+    index.files.should_not.contain('cucumber-0.1.0.tar.gz')
+    list(index.list_files()).should.equal(['gherkin-0.1.0.tar.gz'])
+
+    # And I clean the mess
+    index.delete()
+
+
+def test_replicate_download_failures_do_not_block():
+    "Replicator.replicate() should return even if checking a download fails"
+
+    # Given that I have a replicator whose downloads blow up when checked
+    index = Index(FIXTURE('index'))
+    index.from_data('gherkin-0.1.0.tar.gz', b'gherkin')
+    replicator, downloaded = build_replicator(index, {
+        'http://remote/p/cucumber-0.1.0.tar.gz': b'cucumber',
+    })
+    replicator.local_digest = Mock(side_effect=[None, ValueError('boom')])
+    replicator.releases = Mock(return_value=[
+        release('cucumber', '0.1.0',
+                ('cucumber-0.1.0.tar.gz', sha256(b'cucumber'))),
+    ])
+
+    # When I replicate the server
+    replicator.replicate('http://remote/')
+
+    # Then I see it didn't wait forever for the download
+    replicator.pending.should.equal(0)
+
+    # And I clean the mess
+    index.delete()
+
+
+@patch('curdling.web.replication.REPLICATION_BATCH_SIZE', 2)
+def test_replicator_releases():
+    "Replicator.releases() should ask for packages in batches"
+
+    # Given a server with three packages
+    replicator = Replicator(Index(''), ['http://remote/'])
+    releases = dict((name, [release(name, '0.1.0')])
+                    for name in ('cucumber', 'gherkin', 'pickle'))
+    replicator.get = Mock(return_value=sorted(releases))
+    replicator.post = Mock(side_effect=lambda url, path, data: dict(
+        (name, releases[name]) for name in data['packages']))
+
+    # When I list its releases
+    found = list(replicator.releases('http://remote/'))
+
+    # Then I see all of them, asked two at a time
+    sorted(r['name'] for r in found).should.equal(
+        ['cucumber', 'gherkin', 'pickle'])
+    [c[0][2] for c in replicator.post.call_args_list].should.equal([
+        {'packages': ['cucumber', 'gherkin']},
+        {'packages': ['pickle']},
+    ])
+    replicator.get.assert_called_once_with('http://remote/', 'api/')
+
+
+def test_replicator_releases_without_batch_endpoint():
+    "Replicator.releases() should ask for each package on old servers"
+
+    # Given a server that doesn't know the batch endpoint
+    replicator = Replicator(Index(''), ['http://remote/'])
+    releases = {
+        'api/': ['gherkin', 'cucumber'],
+        'api/gherkin': [release('gherkin', '0.1.0')],
+        'api/cucumber': [release('cucumber', '0.1.0')],
+    }
+    replicator.get = Mock(side_effect=lambda url, path: releases[path])
+    replicator.post = Mock(return_value=None)
+
+    # When I list its releases
+    found = list(replicator.releases('http://remote/'))
+
+    # Then I see each package was asked separately
+    sorted(r['name'] for r in found).should.equal(['cucumber', 'gherkin'])
+    sorted(c[0][1] for c in replicator.get.call_args_list).should.equal(
+        ['api/', 'api/cucumber', 'api/gherkin'])
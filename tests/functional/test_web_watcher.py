@@ -0,0 +1,59 @@
+from __future__ import absolute_import, print_function, unicode_literals
+from curdling.index import Index
+from curdling.web.watcher import Watcher
+from . import FIXTURE
+
+import os
+import time
+import shutil
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def watch_directory(use_inotify):
+    # Given that I have an index being watched
+    os.makedirs(FIXTURE('index'))
+    index = Index(FIXTURE('index'))
+    index.scan()
+    watcher = Watcher(index, 0.05)
+    if not use_inotify:
+        watcher.get_inotify = lambda: None
+    watcher.start()
+
+    try:
+        # When another process drops a file in the directory
+        shutil.copy(FIXTURE('storage1/gherkin-0.1.0.tar.gz'),
+                    FIXTURE('index'))
+
+        # Then I see it gets indexed without anybody asking for it
+        wait_for(lambda: index.has_package('gherkin')).should.be.true
+        index.get('gherkin==0.1.0').should.equal(
+            FIXTURE('index/gherkin-0.1.0.tar.gz'))
+
+        # And when the file is removed
+        os.unlink(FIXTURE('index/gherkin-0.1.0.tar.gz'))
+
+        # Then I see it's gone from the index too
+        wait_for(lambda: not index.has_package('gherkin')).should.be.true
+    finally:
+        # And I see the watcher stops when asked to
+        watcher.stop()
+        watcher.thread.is_alive().should.be.false
+
+        # And I clean the mess
+        index.delete()
+
+
+def test_watcher_polling():
+    "Watcher() should refresh the index every `interval` without inotify"
+    watch_directory(use_inotify=False)
+
+
+def test_watcher_inotify():
+    "Watcher() should refresh the index when inotify tells something changed"
+    watch_directory(use_inotify=True)
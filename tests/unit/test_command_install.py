@@ -109,6 +109,29 @@ def test_handle_requirement_finder():
         'tests', requirement='curdling')
 
 
+def test_handle_requirement_not_cached_skips_index_lookups():
+    "Install#handle() should not search the index for packages it doesn't have"
+
+    # Given that I have the install command with a local cache that knows
+    # about a package
+    index = Index('')
+    index.storage = {'gherkin': {'0.1.0': ['gherkin-0.1.0.tar.gz']}}
+    install = Install(conf={'index': index})
+    install.pipeline()
+    install.finder.queue = Mock()
+
+    # When I request the installation of a package the cache doesn't have
+    with patch.object(index, 'get') as get:
+        install.handle('tests', requirement='curdling')
+
+        # Then I see the index was never searched
+        get.called.should.be.false
+
+    # And that the finder received the request
+    install.finder.queue.assert_called_once_with(
+        'tests', requirement='curdling')
+
+
 def test_handle_link_download():
     "Install#handle() should route all queued links to the downloader"
 
@@ -16,8 +16,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import absolute_import, print_function, unicode_literals
-from curdling.index import Index, PackageNotFound
+from curdling.index import Index, PackageNotFound, VersionList, QueryCache
 from mock import patch
+from pkg_resources import parse_version
 import os
 
 
@@ -173,3 +174,209 @@ def test_index_get_corner_case_pkg_name():
      }
 
     index.get('python-gherkin==0.1.0;~whl').should.equal('python_gherkin-0.1.0.tar.gz')
+
+
+def test_version_list_best():
+    "VersionList.best() should find the newest version matching the constraints"
+
+    # Given a list of versions added out of order
+    versions = VersionList(['0.1.5', '0.2.0', '0.1.0', '0.10.0', '0.1.1'])
+
+    # Then I see they're sorted by their parsed value
+    versions.versions.should.equal(['0.1.0', '0.1.1', '0.1.5', '0.2.0', '0.10.0'])
+
+    # And that I can find the best version for different constraints
+    versions.best([]).should.equal('0.10.0')
+    versions.best([('<', '0.10.0')]).should.equal('0.2.0')
+    versions.best([('<=', '0.1.5')]).should.equal('0.1.5')
+    versions.best([('>', '0.1.0'), ('<', '0.2.0'), ('!=', '0.1.5')]).should.equal('0.1.1')
+    versions.best([('==', '0.1.1'), ('>=', '0.1.0')]).should.equal('0.1.1')
+    versions.best([('==', '0.3.0')]).should.be.none
+    versions.best([('>', '0.10.0')]).should.be.none
+
+
+def test_index_get_after_indexing_new_versions():
+    "Index.get() should see versions indexed after previous lookups"
+
+    # Given an index with one version of a package
+    index = Index('')
+    index.index('gherkin-0.1.0.tar.gz')
+    index.get('gherkin').should.equal('gherkin-0.1.0.tar.gz')
+
+    # When I index a newer version
+    index.index('gherkin-0.2.0.tar.gz')
+
+    # Then I see it being picked up
+    index.get('gherkin').should.equal('gherkin-0.2.0.tar.gz')
+    index.get('gherkin (< 0.2.0)').should.equal('gherkin-0.1.0.tar.gz')
+
+
+@patch('curdling.index.parse_version', side_effect=parse_version)
+def test_index_keeps_sorted_versions_of_existing_versions(patched_parse):
+    "Index should only sort versions again when the set of versions changes"
+
+    # Given an index with two versions of a package, one of them in two
+    # formats
+    index = Index('')
+    index.index('gherkin-0.1.0.tar.gz')
+    index.index('gherkin-0.2.0.tar.gz')
+    index.index('gherkin-0.2.0.zip')
+
+    # When I remove one of the files of a version that still has another
+    index.unindex('gherkin-0.2.0.zip')
+
+    # Then I see each version was only parsed once
+    patched_parse.call_count.should.equal(2)
+
+    # And that the sorted list still belongs to the current versions
+    versions, sorted_versions = index.sorted_versions['gherkin']
+    versions.should.be(index.storage['gherkin'])
+
+    # And when the last file of a version is removed
+    index.unindex('gherkin-0.2.0.tar.gz')
+
+    # Then I see the version is gone from the sorted list
+    index.sorted_versions['gherkin'][1].versions.should.equal(['0.1.0'])
+    patched_parse.call_count.should.equal(2)
+
+
+def test_index_get_caches_results():
+    "Index.get() should cache results and forget them when the package changes"
+
+    # Given an index with a package
+    index = Index('')
+    index.index('gherkin-0.1.0.tar.gz')
+
+    # When I search for the same thing written in different ways
+    index.get('gherkin (>= 0.1.0)').should.equal('gherkin-0.1.0.tar.gz')
+    index.get('Gherkin>=0.1.0').should.equal('gherkin-0.1.0.tar.gz')
+    index.get.when.called_with('gherkin;whl').should.throw(PackageNotFound)
+    index.get.when.called_with('gherkin;whl').should.throw(PackageNotFound)
+
+    # Then I see the second lookups were answered by the cache
+    index.cache.stats().should.equal({'size': 2, 'hits': 2, 'misses': 2})
+
+    # And when a new file of the package is indexed, its entries are gone
+    index.index('gherkin-0.1.0-py27-none-any.whl')
+    index.cache.stats()['size'].should.equal(0)
+    index.get('gherkin;whl').should.equal('gherkin-0.1.0-py27-none-any.whl')
+
+
+def test_query_cache_evicts_least_recently_used():
+    "QueryCache should drop the least recently used entries when full"
+
+    # Given a cache that holds two entries
+    cache = QueryCache(size=2)
+    cache.set('a', 'a;', 'a.tar.gz')
+    cache.set('b', 'b;', 'b.tar.gz')
+
+    # When I use the first entry and add a third one
+    cache.get('a;').should.equal('a.tar.gz')
+    cache.set('c', 'c;', 'c.tar.gz')
+
+    # Then I see the entry that was not used was dropped
+    cache.get('b;').should.be.none
+    cache.get('a;').should.equal('a.tar.gz')
+    cache.get('c;').should.equal('c.tar.gz')
+
+
+def test_index_get_compatible_wheels():
+    "Index.get() should only return wheels compatible with the supported tags"
+
+    # Given an index that supports CPython 2.7 on 64bit linux
+    index = Index('', supported_tags=[
+        ('cp27', 'cp27mu', 'linux_x86_64'),
+        ('cp27', None, None),
+        ('py27', None, None),
+        ('py2', None, None),
+    ])
+
+    # And that has wheels for many platforms and a source package
+    index.index('gherkin-0.1.0-cp33-cp33m-linux_x86_64.whl')
+    index.index('gherkin-0.1.0-cp27-cp27mu-macosx_10_9_x86_64.whl')
+    index.index('gherkin-0.1.0-py2.py3-none-any.whl')
+    index.index('gherkin-0.1.0-cp27-cp27mu-linux_x86_64.whl')
+    index.index('gherkin-0.1.0.tar.gz')
+    index.index('gherkin-0.2.0-cp33-cp33m-linux_x86_64.whl')
+    index.index('gherkin-0.2.0.tar.gz')
+
+    # Then I see the most specific compatible wheel is chosen
+    index.get('gherkin==0.1.0').should.equal(
+        'gherkin-0.1.0-cp27-cp27mu-linux_x86_64.whl')
+    index.get('gherkin==0.1.0;whl').should.equal(
+        'gherkin-0.1.0-cp27-cp27mu-linux_x86_64.whl')
+
+    # And that the source package is used when no wheel is compatible
+    index.get('gherkin').should.equal('gherkin-0.2.0.tar.gz')
+    index.get.when.called_with('gherkin==0.2.0;whl').should.throw(
+        PackageNotFound)
+
+
+def test_index_emits_updated():
+    "Index should emit `updated` when files of a package are added or removed"
+
+    # Given an index with a listener connected to the `updated` signal
+    index = Index('')
+    updates = []
+    index.connect('updated', lambda requester, package: updates.append(package))
+
+    # When I add a package, add it again and then remove it
+    index.index('gherkin-0.1.0.tar.gz')
+    index.index('gherkin-0.1.0.tar.gz')
+    index.unindex('gherkin-0.1.0.tar.gz')
+
+    # Then I see the listener was notified only about real changes
+    updates.should.equal(['gherkin', 'gherkin'])
+
+
+def test_index_emits_updated_when_content_changes():
+    "Index should emit `updated` when a file is replaced by another content"
+
+    # Given an index with a package and a listener connected to `updated`
+    index = Index('')
+    record = index.describe('gherkin-0.1.0.tar.gz')
+    index.index('gherkin-0.1.0.tar.gz', dict(record, size=3, sha256='one'))
+    index.get('gherkin').should.equal('gherkin-0.1.0.tar.gz')
+    updates = []
+    index.connect('updated', lambda requester, package: updates.append(package))
+
+    # When the same file is indexed with the same content and then with
+    # another one
+    index.index('gherkin-0.1.0.tar.gz', dict(record, size=3, sha256='one'))
+    index.index('gherkin-0.1.0.tar.gz', dict(record, size=3, sha256='two'))
+
+    # Then I see the listener was notified only about the new content
+    updates.should.equal(['gherkin'])
+    index.files['gherkin-0.1.0.tar.gz']['sha256'].should.equal('two')
+    index.storage['gherkin'].should.equal({'0.1.0': ['gherkin-0.1.0.tar.gz']})
+
+    # And that cached queries were thrown away
+    index.cache.stats()['size'].should.equal(0)
+
+
+@patch('curdling.index.DistlibWheel')
+@patch('curdling.index.os.stat')
+def test_index_dependencies(stat, DistlibWheel):
+    "Index.dependencies() should read the metadata of each wheel only once"
+
+    # Given an index with a wheel and a source package
+    index = Index('')
+    index.save_journal = lambda file_name, record: None
+    index.index('gherkin-0.1.0-py27-none-any.whl')
+    index.index('gherkin-0.1.0.tar.gz')
+    stat.return_value.st_size = 10
+    stat.return_value.st_mtime = 42
+    DistlibWheel.return_value.metadata.dependencies = {
+        'install': ['forbiddenfruit'],
+    }
+
+    # When I ask for the dependencies of the wheel twice
+    index.dependencies('gherkin-0.1.0-py27-none-any.whl')
+    dependencies = index.dependencies('gherkin-0.1.0-py27-none-any.whl')
+
+    # Then I see the metadata was read once
+    dependencies.should.equal({'install': ['forbiddenfruit'], 'extras': {}})
+    DistlibWheel.call_count.should.equal(1)
+
+    # And that source packages have no dependencies yet
+    index.dependencies('gherkin-0.1.0.tar.gz').should.be.none
@@ -17,6 +17,12 @@ def test_safe_name():
     util.safe_name('package[dev,test]==2.0').should.equal('package[dev,test] (2.0)')
 
 
+def test_canonical_name():
+    "canonical_name() Should normalize project names following PEP 503"
+    util.canonical_name('Zope.Interface').should.equal('zope-interface')
+    util.canonical_name('foo__bar-.baz').should.equal('foo-bar-baz')
+
+
 @patch('io.open')
 def test_expand_requirements(open_func):
     "It should be possible to include other files inside"
@@ -0,0 +1,109 @@
+from __future__ import absolute_import, print_function, unicode_literals
+from curdling.web.metrics import Metrics, Histogram, labels
+from mock import Mock, patch
+
+
+def test_labels():
+    "labels() should sort the labels and escape their values"
+
+    labels().should.equal('')
+    labels(route='api.package', method='GET').should.equal(
+        '{method="GET",route="api.package"}')
+    labels(package='a"b\\c\nd').should.equal(
+        '{package="a\\"b\\\\c\\nd"}')
+
+
+def test_histogram_render():
+    "Histogram.render() should write cumulative buckets, sum and count"
+
+    # Given a histogram with two buckets that observed three values
+    histogram = Histogram(buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    # When I render it
+    lines = histogram.render('latency', route='index')
+
+    # Then I see each bucket counts the values up to its bound
+    lines.should.equal([
+        'latency_bucket{le="0.1",route="index"} 1',
+        'latency_bucket{le="1",route="index"} 2',
+        'latency_bucket{le="+Inf",route="index"} 3',
+        'latency_sum{route="index"} 5.55',
+        'latency_count{route="index"} 3',
+    ])
+
+
+@patch('curdling.web.metrics.os.getpid', return_value=42)
+def test_metrics_render(getpid):
+    "Metrics.render() should write the Prometheus text format"
+
+    # Given the metrics of a server that handled a few requests
+    metrics = Metrics()
+    for method, status in (('GET', 200), ('GET', 200), ('PUT', 200)):
+        metrics.request_started()
+        metrics.request_finished('download', method, status, 0.01, 10)
+        metrics.request_closed()
+    metrics.request_started()
+    metrics.upload_received()
+
+    # And an index and a cache
+    index = Mock(storage={'gherkin': {'0.1.0': ['a', 'b'], '0.2.0': ['c']}})
+    cache = Mock(stats=Mock(return_value={'size': 1, 'hits': 2, 'misses': 3}))
+
+    # When I render the metrics
+    lines = metrics.render(index, {'query': cache}).splitlines()
+
+    # Then I see the requests counted per route, method and status, with
+    # the worker that handled them
+    lines.should.contain(
+        'curdling_http_requests_total{method="GET",route="download",'
+        'status="200",worker="42"} 2')
+    lines.should.contain(
+        'curdling_http_requests_total{method="PUT",route="download",'
+        'status="200",worker="42"} 1')
+    lines.should.contain(
+        'curdling_http_request_duration_seconds_count{route="download",'
+        'worker="42"} 3')
+    lines.should.contain(
+        'curdling_http_response_bytes_total{route="download",'
+        'worker="42"} 30')
+
+    # And the requests in flight and the uploads
+    lines.should.contain('curdling_http_requests_in_flight{worker="42"} 1')
+    lines.should.contain('curdling_uploads_total{worker="42"} 1')
+
+    # And what the index and the caches know
+    lines.should.contain('curdling_index_packages{worker="42"} 1')
+    lines.should.contain(
+        'curdling_index_files{package="gherkin",worker="42"} 3')
+    lines.should.contain(
+        'curdling_cache_hits_total{cache="query",worker="42"} 2')
+    lines.should.contain(
+        'curdling_cache_misses_total{cache="query",worker="42"} 3')
+    lines.should.contain(
+        'curdling_cache_entries{cache="query",worker="42"} 1')
+
+    # And that every metric is declared
+    lines.should.contain('# TYPE curdling_http_requests_total counter')
+    lines.should.contain(
+        '# TYPE curdling_http_request_duration_seconds histogram')
+
+
+def test_metrics_unknown_methods():
+    "Metrics should count methods it doesn't know under the same label"
+
+    # Given some metrics
+    metrics = Metrics()
+
+    # When clients send requests with made up methods
+    metrics.request_finished('none', 'FOO', 405, 0.01, 0)
+    metrics.request_finished('none', 'BAR', 405, 0.01, 0)
+    metrics.request_finished('none', 'GET', 404, 0.01, 0)
+
+    # Then I see they share a single series
+    dict(metrics.requests).should.equal({
+        ('none', 'other', 405): 2,
+        ('none', 'GET', 404): 1,
+    })
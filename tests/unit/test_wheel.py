@@ -1,5 +1,6 @@
 from mock import Mock
-from curdling.wheel import Wheel
+import sys
+from curdling.wheel import Wheel, supported_tags
 from curdling.version import __version__
 
 
@@ -129,3 +130,34 @@ Tag: py3-none-any
         'Root-Is-Purelib': 'true',
         'Tag': ['py27-none-any', 'py3-none-any']
     })
+
+
+def test_all_tags():
+    "Wheel.all_tags() Should expand all the compressed tags of the wheel"
+
+    # Given the following wheel
+    wheel = Wheel.from_name('curdzz-0.1.2-py27.py33-cp27mu.cp33m-linux_x86_64.whl')
+
+    # When I expand its tags
+    tags = wheel.all_tags()
+
+    # Then I see all the combinations
+    tags.should.equal([
+        ('py27', 'cp27mu', 'linux_x86_64'),
+        ('py27', 'cp33m', 'linux_x86_64'),
+        ('py33', 'cp27mu', 'linux_x86_64'),
+        ('py33', 'cp33m', 'linux_x86_64'),
+    ])
+
+
+def test_supported_tags():
+    "supported_tags() Should list pure python tags of the running interpreter"
+
+    # When I list the tags supported by the running interpreter
+    tags = supported_tags()
+
+    # Then I see pure python wheels in the list, after the platform
+    # specific ones
+    pure = ('py{0}'.format(sys.version_info[0]), None, None)
+    tags.should.contain(pure)
+    tags.index(pure).should.be.greater_than(0)